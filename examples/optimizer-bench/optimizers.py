@@ -1,11 +1,59 @@
 from __future__ import annotations
 
-from typing import Iterable
+from typing import Any, Callable, Iterable
 
 import torch
+import torch.distributed as dist
 from torch.optim import Optimizer
 
 
+class _FlatBucket:
+    """Parameters of one (device, dtype) group packed into contiguous buffers.
+
+    Each parameter is re-pointed at a view of ``flat_param`` and every state
+    entry named in ``keys`` becomes a view of one buffer per key, so
+    ``Optimizer.state`` (and therefore ``state_dict``) still holds one tensor
+    per parameter while the step can run on the whole bucket at once.
+    """
+
+    def __init__(self, params: list[torch.Tensor], state: dict, keys: tuple[str, ...]):
+        self.params = params
+        self.numels = [p.numel() for p in params]
+        self.repeats = torch.tensor(self.numels, device=params[0].device)
+        self.flat_param = torch.cat([p.detach().reshape(-1) for p in params])
+        for p, view in zip(params, self.views(self.flat_param)):
+            p.data = view
+
+        self.flat_state: dict[str, torch.Tensor] = {}
+        for key in keys:
+            flat = torch.zeros_like(self.flat_param)
+            for p, view in zip(params, self.views(flat)):
+                if key in state[p]:
+                    view.copy_(state[p][key])
+                state[p][key] = view
+            self.flat_state[key] = flat
+
+    def views(self, flat: torch.Tensor) -> list[torch.Tensor]:
+        return [v.view_as(p) for p, v in zip(self.params, flat.split(self.numels))]
+
+    def has_all_grads(self) -> bool:
+        return all(p.grad is not None for p in self.params)
+
+    def flat_grad(self) -> torch.Tensor:
+        return torch.cat([p.grad.reshape(-1) for p in self.params])
+
+    def expand(self, per_tensor: torch.Tensor) -> torch.Tensor:
+        """Broadcast one value per parameter to the flat layout."""
+        return per_tensor.repeat_interleave(self.repeats)
+
+
+def _build_flat_buckets(params: Iterable[torch.Tensor], state: dict, keys: tuple[str, ...]) -> list[_FlatBucket]:
+    grouped: dict[tuple[torch.device, torch.dtype], list[torch.Tensor]] = {}
+    for p in params:
+        grouped.setdefault((p.device, p.dtype), []).append(p)
+    return [_FlatBucket(ps, state, keys) for ps in grouped.values()]
+
+
 class LAMB(Optimizer):
     """Minimal LAMB implementation for benchmarking demos."""
 
@@ -16,9 +64,19 @@ class LAMB(Optimizer):
         betas: tuple[float, float] = (0.9, 0.999),
         eps: float = 1e-8,
         weight_decay: float = 0.0,
+        foreach: bool = False,
+        flat_state: bool = False,
     ):
-        defaults = dict(lr=lr, betas=betas, eps=eps, weight_decay=weight_decay)
+        defaults = dict(
+            lr=lr, betas=betas, eps=eps, weight_decay=weight_decay, foreach=foreach, flat_state=flat_state
+        )
         super().__init__(params, defaults)
+        self._flat_buckets: dict[int, list[_FlatBucket]] = {}
+
+    def load_state_dict(self, state_dict: dict) -> None:
+        super().load_state_dict(state_dict)
+        # Loaded tensors are no longer views of our buffers; re-pack on the next step.
+        self._flat_buckets = {}
 
     @torch.no_grad()
     def step(self, closure=None):
@@ -27,12 +85,30 @@ class LAMB(Optimizer):
             with torch.enable_grad():
                 loss = closure()
 
-        for group in self.param_groups:
+        for idx, group in enumerate(self.param_groups):
             beta1, beta2 = group["betas"]
             eps = group["eps"]
             lr = group["lr"]
             wd = group["weight_decay"]
 
+            if group["flat_state"]:
+                buckets = self._flat_buckets.get(idx)
+                if buckets is None:
+                    for p in group["params"]:
+                        self.state[p].setdefault("step", 0)
+                    buckets = _build_flat_buckets(group["params"], self.state, ("exp_avg", "exp_avg_sq"))
+                    self._flat_buckets[idx] = buckets
+                # Parameters without a gradient must keep their state untouched,
+                # so such buckets go through the per-tensor loop on the views.
+                if all(b.has_all_grads() for b in buckets):
+                    for bucket in buckets:
+                        self._flat_step(group, bucket)
+                    continue
+
+            if group["foreach"]:
+                self._foreach_step(group)
+                continue
+
             for p in group["params"]:
                 if p.grad is None:
                     continue
@@ -67,49 +143,274 @@ class LAMB(Optimizer):
 
         return loss
 
+    def _foreach_step(self, group: dict) -> None:
+        """Same update as the per-tensor loop, issued as multi-tensor kernels.
+
+        Parameters are bucketed by (device, dtype) so every ``torch._foreach_*``
+        call sees a homogeneous list; the weight and update norms for a bucket
+        come out of a single ``_foreach_norm`` each.
+        """
+        beta1, beta2 = group["betas"]
+        eps = group["eps"]
+        lr = group["lr"]
+        wd = group["weight_decay"]
+
+        buckets: dict[tuple[torch.device, torch.dtype], list[torch.Tensor]] = {}
+        for p in group["params"]:
+            if p.grad is None:
+                continue
+            if p.grad.is_sparse:
+                raise RuntimeError("LAMB does not support sparse gradients")
+            buckets.setdefault((p.device, p.dtype), []).append(p)
+
+        for params in buckets.values():
+            grads = [p.grad for p in params]
+            exp_avgs = []
+            exp_avg_sqs = []
+            for p in params:
+                state = self.state[p]
+                if len(state) == 0:
+                    state["step"] = 0
+                    state["exp_avg"] = torch.zeros_like(p)
+                    state["exp_avg_sq"] = torch.zeros_like(p)
+                state["step"] += 1
+                exp_avgs.append(state["exp_avg"])
+                exp_avg_sqs.append(state["exp_avg_sq"])
+
+            torch._foreach_mul_(exp_avgs, beta1)
+            torch._foreach_add_(exp_avgs, grads, alpha=1 - beta1)
+            torch._foreach_mul_(exp_avg_sqs, beta2)
+            torch._foreach_addcmul_(exp_avg_sqs, grads, grads, value=1 - beta2)
+
+            denoms = torch._foreach_sqrt(exp_avg_sqs)
+            torch._foreach_add_(denoms, eps)
+            updates = torch._foreach_div(exp_avgs, denoms)
+            if wd > 0:
+                torch._foreach_add_(updates, params, alpha=wd)
+
+            w_norms = torch.stack(torch._foreach_norm(params)).clamp(min=eps)
+            u_norms = torch.stack(torch._foreach_norm(updates)).clamp(min=eps)
+            scales = (w_norms / u_norms).clamp(max=10.0).mul(-lr)
+
+            torch._foreach_mul_(updates, list(scales.unbind()))
+            torch._foreach_add_(params, updates)
+
+    def _flat_step(self, group: dict, bucket: _FlatBucket) -> None:
+        beta1, beta2 = group["betas"]
+        eps = group["eps"]
+        lr = group["lr"]
+        wd = group["weight_decay"]
+
+        for p in bucket.params:
+            if p.grad.is_sparse:
+                raise RuntimeError("LAMB does not support sparse gradients")
+            self.state[p]["step"] += 1
+
+        grad = bucket.flat_grad()
+        exp_avg = bucket.flat_state["exp_avg"]
+        exp_avg_sq = bucket.flat_state["exp_avg_sq"]
+        exp_avg.mul_(beta1).add_(grad, alpha=1 - beta1)
+        exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+
+        update = exp_avg / exp_avg_sq.sqrt().add_(eps)
+        if wd > 0:
+            update.add_(bucket.flat_param, alpha=wd)
+
+        w_norms = torch.stack(torch._foreach_norm(bucket.views(bucket.flat_param))).clamp(min=eps)
+        u_norms = torch.stack(torch._foreach_norm(bucket.views(update))).clamp(min=eps)
+        scales = (w_norms / u_norms).clamp(max=10.0).mul(-lr)
+        bucket.flat_param.add_(update.mul_(bucket.expand(scales)))
+
 
 class SAM:
-    """Sharpness-Aware Minimization wrapper around a base optimizer."""
+    """Sharpness-Aware Minimization wrapper around a base optimizer.
+
+    ``variant`` trades ascent quality for compute:
+
+    - ``"standard"``: perturb every step (two forward/backward passes).
+    - ``"looksam"``: perturb every ``looksam_k`` steps. In between, reuse the
+      stored component of the SAM gradient orthogonal to the plain gradient
+      (LookSAM, Liu et al. 2022), so those steps need a single pass.
+    - ``"partial"``: perturb only ``perturb_params``. The other parameters keep
+      their first-pass gradient and are frozen during the second pass, so its
+      backward stops at the lowest perturbed layer.
+
+    ``first_step`` returns whether the caller must run the second pass. The
+    perturbation only depends on the gradient direction, so it can be taken
+    from loss-scaled (fp16) gradients; pass ``base_step`` to ``second_step``
+    to route the base update through a ``GradScaler``.
+    ``compute_multiplier`` is the average forward/backward cost per step
+    relative to the base optimizer alone (plain SGD is 1.0, standard SAM 2.0),
+    with the second pass weighted by ``second_pass_cost``.
+    """
+
+    VARIANTS = ("standard", "looksam", "partial")
 
-    def __init__(self, params: Iterable[torch.nn.Parameter], base_optimizer: Optimizer, rho: float = 0.05, eps: float = 1e-12):
+    def __init__(
+        self,
+        params: Iterable[torch.nn.Parameter],
+        base_optimizer: Optimizer,
+        rho: float = 0.05,
+        eps: float = 1e-12,
+        variant: str = "standard",
+        looksam_k: int = 5,
+        looksam_alpha: float = 0.7,
+        perturb_params: Iterable[torch.nn.Parameter] | None = None,
+    ):
+        if variant not in self.VARIANTS:
+            raise ValueError(f"Unknown SAM variant: {variant}. Expected one of {self.VARIANTS}")
         self.params = list(params)
         self.base_optimizer = base_optimizer
         self.rho = rho
         self.eps = eps
+        self.variant = variant
+        self.looksam_k = looksam_k
+        self.looksam_alpha = looksam_alpha
+        self.perturb_params = self.params if perturb_params is None else list(perturb_params)
+
+        # FLOPs of the second forward/backward relative to the first. Partial
+        # SAM's depends on where the perturbed layers sit, so the caller
+        # measures it on the first step (see ``train.train_step``).
+        self.second_pass_cost: float | None = None if variant == "partial" else 1.0
+        self._num_steps = 0
+        self._num_passes = 0.0
+        self._perturbed = False
+        self._frozen: list[torch.nn.Parameter] = []
+        # Perturbation buffers are allocated once and reused every step.
+        self._e_w: dict[torch.nn.Parameter, torch.Tensor] = {}
+        self._perturbed_params: list[torch.nn.Parameter] = []
+
+    @property
+    def compute_multiplier(self) -> float:
+        return self._num_passes / max(self._num_steps, 1)
 
     def zero_grad(self):
         self.base_optimizer.zero_grad()
 
+    def state_dict(self) -> dict:
+        """Base optimizer state (including LookSAM's stored ``_sam_g_v``) plus the step counters."""
+        return {
+            "base_optimizer": self.base_optimizer.state_dict(),
+            "num_steps": self._num_steps,
+            "num_passes": self._num_passes,
+        }
+
+    def load_state_dict(self, state_dict: dict) -> None:
+        self.base_optimizer.load_state_dict(state_dict["base_optimizer"])
+        self._num_steps = int(state_dict["num_steps"])
+        self._num_passes = float(state_dict["num_passes"])
+
     @torch.no_grad()
-    def _grad_norm(self) -> torch.Tensor:
-        norms = []
-        for p in self.params:
-            if p.grad is not None:
-                norms.append(torch.norm(p.grad, p=2))
-        if not norms:
+    def _grad_norm(self, params: Iterable[torch.nn.Parameter] | None = None) -> torch.Tensor:
+        grads = [p.grad for p in (self.params if params is None else params) if p.grad is not None]
+        if not grads:
             return torch.tensor(0.0)
-        return torch.norm(torch.stack(norms), p=2)
+        return torch.linalg.vector_norm(torch.stack(torch._foreach_norm(grads)))
 
     @torch.no_grad()
-    def first_step(self):
-        grad_norm = self._grad_norm()
-        scale = self.rho / (grad_norm + self.eps)
-        for p in self.params:
-            if p.grad is None:
-                continue
-            e_w = p.grad * scale
-            p.add_(e_w)
-            self.base_optimizer.state[p]["_sam_e_w"] = e_w
+    def first_step(self) -> bool:
+        if self.variant == "looksam" and self._num_steps % self.looksam_k != 0:
+            return False
+
+        params = [p for p in self.perturb_params if p.grad is not None]
+        grad_norm = self._grad_norm(params)
+        if not torch.isfinite(grad_norm):
+            # Overflowed (loss-scaled) gradients: skip the ascent rather than
+            # writing inf/nan into the weights. The base step is skipped by the scaler.
+            params = []
+        if params:
+            grads = [p.grad for p in params]
+            scale = self.rho / (grad_norm + self.eps)
+            e_ws = [self._e_w.get(p) for p in params]
+            if any(e_w is None for e_w in e_ws):
+                for p in params:
+                    self._e_w.setdefault(p, torch.empty_like(p))
+                e_ws = [self._e_w[p] for p in params]
+            torch._foreach_copy_(e_ws, grads)
+            torch._foreach_mul_(e_ws, scale)
+            torch._foreach_add_(params, e_ws)
+        self._perturbed_params = params
+
+        if self.variant == "looksam":
+            # Keep the clean gradient to split the SAM gradient in second_step.
+            for p in self.params:
+                if p.grad is not None:
+                    self.base_optimizer.state[p]["_sam_g"] = p.grad
+                    p.grad = None
+        elif self.variant == "partial":
+            perturbed = {id(p) for p in self.perturb_params}
+            for p in self.params:
+                if id(p) in perturbed or not p.requires_grad:
+                    continue
+                if p.grad is not None:
+                    self.base_optimizer.state[p]["_sam_g"] = p.grad
+                    p.grad = None
+                p.requires_grad_(False)
+                self._frozen.append(p)
+
+        self._perturbed = True
+        return True
 
     @torch.no_grad()
-    def second_step(self):
+    def second_step(self, base_step: Callable[[], Any] | None = None):
+        if self._perturbed:
+            params = self._perturbed_params
+            if params:
+                torch._foreach_sub_(params, [self._e_w[p] for p in params])
+            self._perturbed_params = []
+            if self.variant == "looksam":
+                self._store_orthogonal_grad()
+            elif self.variant == "partial":
+                for p in self._frozen:
+                    p.requires_grad_(True)
+                    g = self.base_optimizer.state[p].pop("_sam_g", None)
+                    if g is not None:
+                        p.grad = g
+                self._frozen = []
+            self._num_passes += 1.0 + (1.0 if self.second_pass_cost is None else self.second_pass_cost)
+            self._perturbed = False
+        else:
+            self._reuse_orthogonal_grad()
+            self._num_passes += 1.0
+
+        self._num_steps += 1
+        if base_step is None:
+            self.base_optimizer.step()
+        else:
+            base_step()
+
+    def _store_orthogonal_grad(self) -> None:
+        """Store g_v = g_s - (<g, g_s> / |g|^2) g, the part of the SAM gradient LookSAM reuses."""
+        pairs = []
         for p in self.params:
-            if p.grad is None:
-                continue
-            e_w = self.base_optimizer.state[p].pop("_sam_e_w", None)
-            if e_w is not None:
-                p.sub_(e_w)
-        self.base_optimizer.step()
+            g = self.base_optimizer.state[p].pop("_sam_g", None)
+            if g is not None and p.grad is not None:
+                pairs.append((p, g))
+        if not pairs:
+            return
+        dot = sum((g * p.grad).sum() for p, g in pairs)
+        g_sq = sum((g * g).sum() for _, g in pairs)
+        if not (torch.isfinite(dot) and torch.isfinite(g_sq)):
+            # Overflowed (loss-scaled) gradients: keep the previous g_v rather
+            # than reusing inf/nan until the next SAM step.
+            return
+        coef = dot / (g_sq + self.eps)
+        for p, g in pairs:
+            self.base_optimizer.state[p]["_sam_g_v"] = p.grad - coef * g
+
+    def _reuse_orthogonal_grad(self) -> None:
+        pairs = []
+        for p in self.params:
+            g_v = self.base_optimizer.state[p].get("_sam_g_v")
+            if g_v is not None and p.grad is not None:
+                pairs.append((p, g_v))
+        if not pairs:
+            return
+        g_norm = self._grad_norm(p for p, _ in pairs)
+        g_v_norm = torch.linalg.vector_norm(torch.stack(torch._foreach_norm([g_v for _, g_v in pairs])))
+        coef = self.looksam_alpha * g_norm / (g_v_norm + self.eps)
+        for p, g_v in pairs:
+            p.grad.add_(g_v * coef)
 
 
 class MuonLite(Optimizer):
@@ -127,9 +428,15 @@ class MuonLite(Optimizer):
         momentum: float = 0.95,
         weight_decay: float = 0.0,
         eps: float = 1e-8,
+        flat_state: bool = False,
     ):
-        defaults = dict(lr=lr, momentum=momentum, weight_decay=weight_decay, eps=eps)
+        defaults = dict(lr=lr, momentum=momentum, weight_decay=weight_decay, eps=eps, flat_state=flat_state)
         super().__init__(params, defaults)
+        self._flat_buckets: dict[int, list[_FlatBucket]] = {}
+
+    def load_state_dict(self, state_dict: dict) -> None:
+        super().load_state_dict(state_dict)
+        self._flat_buckets = {}
 
     @torch.no_grad()
     def step(self, closure=None):
@@ -138,12 +445,29 @@ class MuonLite(Optimizer):
             with torch.enable_grad():
                 loss = closure()
 
-        for group in self.param_groups:
+        for idx, group in enumerate(self.param_groups):
             lr = group["lr"]
             momentum = group["momentum"]
             wd = group["weight_decay"]
             eps = group["eps"]
 
+            if group["flat_state"]:
+                buckets = self._flat_buckets.get(idx)
+                if buckets is None:
+                    buckets = _build_flat_buckets(group["params"], self.state, ("momentum_buffer",))
+                    self._flat_buckets[idx] = buckets
+                if all(b.has_all_grads() for b in buckets):
+                    for bucket in buckets:
+                        grad = bucket.flat_grad()
+                        if wd > 0:
+                            grad.add_(bucket.flat_param, alpha=wd)
+                        norms = torch.stack(torch._foreach_norm(bucket.views(grad))).clamp(min=eps)
+                        grad.div_(bucket.expand(norms))
+                        buf = bucket.flat_state["momentum_buffer"]
+                        buf.mul_(momentum).add_(grad, alpha=1 - momentum)
+                        bucket.flat_param.add_(buf, alpha=-lr)
+                    continue
+
             for p in group["params"]:
                 if p.grad is None:
                     continue
@@ -163,3 +487,263 @@ class MuonLite(Optimizer):
                 p.add_(buf, alpha=-lr)
 
         return loss
+
+
+def zeropower_via_newtonschulz(G: torch.Tensor, steps: int = 5, dtype: torch.dtype = torch.bfloat16) -> torch.Tensor:
+    """Approximately orthogonalize a batch of matrices ``G`` of shape ``[..., m, n]``.
+
+    Uses the quintic Newton-Schulz iteration from the reference Muon
+    implementation. Leading dimensions are treated as a batch, so every
+    iteration is one stacked matmul for all matrices of the same shape.
+    """
+    a, b, c = (3.4445, -4.7750, 2.0315)
+    X = G.to(dtype)
+    transposed = G.size(-2) > G.size(-1)
+    if transposed:
+        X = X.mT
+    X = X / (X.norm(dim=(-2, -1), keepdim=True) + 1e-7)
+    for _ in range(steps):
+        A = X @ X.mT
+        B = b * A + c * (A @ A)
+        X = a * X + B @ X
+    if transposed:
+        X = X.mT
+    return X
+
+
+class Muon(Optimizer):
+    """Muon: momentum followed by Newton-Schulz orthogonalization.
+
+    Param groups with ``use_muon=True`` hold weight matrices (conv kernels are
+    flattened to ``[out, -1]``). All other groups (embeddings, biases, norm
+    weights) are updated with AdamW using the ``adamw_*`` settings, so the
+    whole model can be handed to one optimizer. Use ``build_optimizer`` in
+    ``train.py`` to get the split for a model.
+    """
+
+    def __init__(
+        self,
+        params: Iterable[torch.nn.Parameter] | Iterable[dict],
+        lr: float = 0.02,
+        momentum: float = 0.95,
+        nesterov: bool = True,
+        ns_steps: int = 5,
+        ns_dtype: torch.dtype = torch.bfloat16,
+        weight_decay: float = 0.0,
+        adamw_lr: float = 1e-3,
+        adamw_betas: tuple[float, float] = (0.9, 0.999),
+        adamw_eps: float = 1e-8,
+        adamw_weight_decay: float = 0.0,
+    ):
+        defaults = dict(
+            lr=lr,
+            momentum=momentum,
+            nesterov=nesterov,
+            ns_steps=ns_steps,
+            ns_dtype=ns_dtype,
+            weight_decay=weight_decay,
+            adamw_lr=adamw_lr,
+            adamw_betas=adamw_betas,
+            adamw_eps=adamw_eps,
+            adamw_weight_decay=adamw_weight_decay,
+            use_muon=True,
+        )
+        super().__init__(params, defaults)
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+
+        for group in self.param_groups:
+            if group["use_muon"]:
+                self._muon_step(group)
+            else:
+                self._adamw_step(group)
+
+        return loss
+
+    def _muon_step(self, group: dict) -> None:
+        lr = group["lr"]
+        momentum = group["momentum"]
+        wd = group["weight_decay"]
+
+        by_shape: dict[tuple[torch.Size, torch.device], list[tuple[torch.Tensor, torch.Tensor]]] = {}
+        for p in group["params"]:
+            if p.grad is None:
+                continue
+            state = self.state[p]
+            if len(state) == 0:
+                state["momentum_buffer"] = torch.zeros_like(p)
+
+            buf = state["momentum_buffer"]
+            buf.lerp_(p.grad, 1 - momentum)
+            update = p.grad.lerp(buf, momentum) if group["nesterov"] else buf.clone()
+            update = update.reshape(update.size(0), -1)
+            by_shape.setdefault((update.shape, p.device), []).append((p, update))
+
+        for (shape, _), items in by_shape.items():
+            stacked = torch.stack([u for _, u in items])
+            ortho = zeropower_via_newtonschulz(stacked, steps=group["ns_steps"], dtype=group["ns_dtype"])
+            scale = max(1.0, shape[0] / shape[1]) ** 0.5
+            for (p, _), o in zip(items, ortho.unbind()):
+                if wd > 0:
+                    p.mul_(1 - lr * wd)
+                p.add_(o.view_as(p).to(p.dtype), alpha=-lr * scale)
+
+    def _adamw_step(self, group: dict) -> None:
+        lr = group["adamw_lr"]
+        beta1, beta2 = group["adamw_betas"]
+        eps = group["adamw_eps"]
+        wd = group["adamw_weight_decay"]
+
+        for p in group["params"]:
+            if p.grad is None:
+                continue
+            state = self.state[p]
+            if len(state) == 0:
+                state["step"] = 0
+                state["exp_avg"] = torch.zeros_like(p)
+                state["exp_avg_sq"] = torch.zeros_like(p)
+
+            state["step"] += 1
+            exp_avg = state["exp_avg"]
+            exp_avg_sq = state["exp_avg_sq"]
+            exp_avg.lerp_(p.grad, 1 - beta1)
+            exp_avg_sq.mul_(beta2).addcmul_(p.grad, p.grad, value=1 - beta2)
+
+            bias_correction1 = 1 - beta1 ** state["step"]
+            bias_correction2 = 1 - beta2 ** state["step"]
+            denom = (exp_avg_sq / bias_correction2).sqrt_().add_(eps)
+            if wd > 0:
+                p.mul_(1 - lr * wd)
+            p.addcdiv_(exp_avg, denom, value=-lr / bias_correction1)
+
+
+class _ShardState(dict):
+    """``state`` of a ``ZeroShardedOptimizer``.
+
+    Entries of locally owned parameters resolve to the wrapped optimizer's
+    state. Anything else stored per parameter (e.g. SAM's stashed gradients)
+    lives here, so the wrapped optimizer's ``state_dict`` only sees its shard.
+    """
+
+    def __init__(self, optimizer: Optimizer, local_params: Iterable[torch.Tensor]):
+        super().__init__()
+        # Looked up on every access: ``Optimizer.load_state_dict`` replaces ``optimizer.state``.
+        self.optimizer = optimizer
+        self.local_params = set(local_params)
+
+    def __missing__(self, p: torch.Tensor) -> dict:
+        if p in self.local_params:
+            return self.optimizer.state[p]
+        value = self[p] = {}
+        return value
+
+
+class ZeroShardedOptimizer:
+    """ZeRO stage 1: partition optimizer state and the step across data-parallel ranks.
+
+    Wraps an already constructed optimizer. Every parameter is owned by one
+    rank (greedy by size, same assignment on every rank) and the wrapped
+    optimizer keeps only its owned parameters, so it allocates state for and
+    updates roughly ``1 / world`` of the model. After the local step the
+    updated parameters are all-gathered, leaving every replica identical.
+
+    Partitioning is per tensor, so per-tensor rules (LAMB's trust ratio,
+    Adafactor's factored moments, Muon's orthogonalization) see whole tensors
+    and give the same update as the unsharded optimizer. ``param_groups``
+    still lists every parameter so ``GradScaler`` finds the same infs on all
+    ranks and they skip steps together; hyperparameters written there are
+    copied into the wrapped optimizer before each step. Gradients must
+    already be averaged across ranks (DDP does this in ``backward``).
+    ``state_dict`` is this rank's shard, so every rank saves and loads its own.
+    """
+
+    def __init__(self, optimizer: Optimizer, group: dist.ProcessGroup | None = None):
+        self.optimizer = optimizer
+        self.group = group
+        self.rank = dist.get_rank(group)
+        self.world = dist.get_world_size(group)
+        if optimizer.state:
+            raise ValueError("ZeroShardedOptimizer must wrap an optimizer before its first step")
+
+        self.param_groups = [dict(g, params=list(g["params"])) for g in optimizer.param_groups]
+        params = [p for g in self.param_groups for p in g["params"]]
+        if len({(p.dtype, p.device) for p in params}) > 1:
+            raise ValueError("ZeroShardedOptimizer expects parameters of a single dtype and device")
+
+        loads = [0] * self.world
+        owner: dict[torch.Tensor, int] = {}
+        # Largest first; sorted() is stable, so ties keep model order on every rank.
+        for p in sorted(params, key=lambda p: -p.numel()):
+            rank = min(range(self.world), key=loads.__getitem__)
+            owner[p] = rank
+            loads[rank] += p.numel()
+        self._shards = [[p for p in params if owner[p] == rank] for rank in range(self.world)]
+        self._shard_numel = max(loads)
+        for g in optimizer.param_groups:
+            g["params"] = [p for p in g["params"] if owner[p] == self.rank]
+        self.state = _ShardState(optimizer, self._shards[self.rank])
+
+    @property
+    def defaults(self) -> dict:
+        return self.optimizer.defaults
+
+    def zero_grad(self, set_to_none: bool = True) -> None:
+        for g in self.param_groups:
+            for p in g["params"]:
+                if p.grad is None:
+                    continue
+                if set_to_none:
+                    p.grad = None
+                else:
+                    p.grad.detach_().zero_()
+
+    def step(self, closure: Callable[[], Any] | None = None):
+        for full, local in zip(self.param_groups, self.optimizer.param_groups):
+            local.update((k, v) for k, v in full.items() if k != "params")
+        loss = self.optimizer.step() if closure is None else self.optimizer.step(closure)
+        self._all_gather_params()
+        return loss
+
+    @torch.no_grad()
+    def _all_gather_params(self) -> None:
+        # One collective per step: every rank sends its shard padded to the largest shard.
+        local = self._shards[self.rank]
+        ref = local[0] if local else self.param_groups[0]["params"][0]
+        send = ref.new_zeros(self._shard_numel)
+        if local:
+            torch.cat([p.reshape(-1) for p in local], out=send[: sum(p.numel() for p in local)])
+        recv = [torch.empty_like(send) for _ in range(self.world)]
+        dist.all_gather(recv, send, group=self.group)
+        for rank, shard in enumerate(self._shards):
+            if rank == self.rank or not shard:
+                continue
+            views = recv[rank][: sum(p.numel() for p in shard)].split([p.numel() for p in shard])
+            torch._foreach_copy_(shard, [v.view_as(p) for p, v in zip(shard, views)])
+
+    def state_bytes(self) -> int:
+        """Bytes of optimizer state tensors held by this rank."""
+        total = 0
+        for p in self._shards[self.rank]:
+            for key, value in self.optimizer.state.get(p, {}).items():
+                # Underscored entries are SAM's stashed gradients, not optimizer state.
+                if torch.is_tensor(value) and not key.startswith("_"):
+                    total += value.numel() * value.element_size()
+        return total
+
+    def state_dict(self) -> dict:
+        """The wrapped optimizer's shard plus per-parameter entries kept for other ranks' parameters."""
+        index = {p: i for i, p in enumerate(p for g in self.param_groups for p in g["params"])}
+        return {"local": self.optimizer.state_dict(), "other": {index[p]: dict(v) for p, v in self.state.items()}}
+
+    def load_state_dict(self, state_dict: dict) -> None:
+        self.optimizer.load_state_dict(state_dict["local"])
+        params = [p for g in self.param_groups for p in g["params"]]
+        self.state.clear()
+        for i, entry in state_dict["other"].items():
+            p = params[int(i)]
+            self.state[p] = {k: v.to(p.device) if torch.is_tensor(v) else v for k, v in entry.items()}
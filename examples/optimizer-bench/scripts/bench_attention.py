@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import torch
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from train import SdpaCausalLm, TinyCausalLm  # noqa: E402
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Compare train-step tokens/sec of the nn.TransformerEncoder LM and the SDPA LM across block sizes."
+    )
+    parser.add_argument("--block-size", type=int, nargs="+", default=[64, 128, 256, 512])
+    parser.add_argument("--tokens-per-batch", type=int, default=4096, help="batch_size = tokens_per_batch // block_size.")
+    parser.add_argument("--vocab-size", type=int, default=512, help="Small by default so attention dominates.")
+    parser.add_argument("--model-dim", type=int, default=256)
+    parser.add_argument("--num-layers", type=int, default=4)
+    parser.add_argument("--num-heads", type=int, default=4)
+    parser.add_argument("--ffn-dim", type=int, default=1024)
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=0, help="torch threads; 0 keeps the default.")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+
+def step_ms(model: torch.nn.Module, ids: torch.Tensor, steps: int) -> float:
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-3)
+
+    def step() -> None:
+        optimizer.zero_grad()
+        model(ids[:, :-1], ids[:, 1:]).backward()
+        optimizer.step()
+
+    step()  # warmup, allocates optimizer state
+    start = time.perf_counter()
+    for _ in range(steps):
+        step()
+    return (time.perf_counter() - start) / steps * 1e3
+
+
+def main() -> None:
+    args = parse_args()
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    variants = {
+        "encoder": lambda kw: TinyCausalLm(**kw),
+        "sdpa": lambda kw: SdpaCausalLm(**kw),
+        "sdpa_rotary": lambda kw: SdpaCausalLm(**kw, rotary=True),
+    }
+    for block_size in args.block_size:
+        batch_size = max(1, args.tokens_per_batch // block_size)
+        kwargs = dict(
+            vocab_size=args.vocab_size,
+            model_dim=args.model_dim,
+            num_layers=args.num_layers,
+            num_heads=args.num_heads,
+            ffn_dim=args.ffn_dim,
+            max_len=block_size,
+            dropout=0.1,
+        )
+        ids = torch.randint(0, args.vocab_size, (batch_size, block_size + 1))
+        results = []
+        for name, build in variants.items():
+            torch.manual_seed(args.seed)
+            ms = step_ms(build(kwargs), ids, args.steps)
+            results.append(f"{name}_ms={ms:.1f} {name}_tokens_per_sec={batch_size * block_size / ms * 1e3:.0f}")
+        print(f"block_size={block_size} batch_size={batch_size} " + " ".join(results), flush=True)
+
+
+if __name__ == "__main__":
+    main()
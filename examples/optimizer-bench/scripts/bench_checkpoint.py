@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import argparse
+import math
+import sys
+import time
+from pathlib import Path
+
+import torch
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bench_utils import peak_memory_mb, run_single  # noqa: E402
+from train import SdpaCausalLm, TinyCausalLm  # noqa: E402
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Compare peak memory and step time of LM training with and without activation checkpointing, "
+        "and search the largest block_size that fits --budget-mb for each setting. On CPU each configuration "
+        "runs in a fresh process, since peak RSS is a per-process high-water mark."
+    )
+    parser.add_argument("--checkpoint-every", type=int, nargs="+", default=[0, 2, 1], help="0 = no checkpointing.")
+    parser.add_argument("--block-size", type=int, nargs="+", default=[256, 512, 1024])
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--model", choices=["encoder", "sdpa"], default="encoder")
+    parser.add_argument("--num-layers", type=int, default=4)
+    parser.add_argument("--vocab-size", type=int, default=50257)
+    parser.add_argument("--loss-chunk-size", type=int, default=1024, help="Keeps the logits out of the comparison.")
+    parser.add_argument("--steps", type=int, default=3)
+    parser.add_argument(
+        "--budget-mb", type=float, default=0.0, help="If set, double block_size until peak memory exceeds this."
+    )
+    parser.add_argument("--search-max", type=int, default=16384)
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def run(args: argparse.Namespace, block_size: int, checkpoint_every: int) -> tuple[float, float]:
+    """Peak memory (MB) and mean step time (ms) of training at ``block_size``."""
+    torch.manual_seed(args.seed)
+    device = torch.device(args.device)
+    if device.type == "cuda":
+        torch.cuda.empty_cache()
+        torch.cuda.reset_peak_memory_stats(device)
+    model_cls = TinyCausalLm if args.model == "encoder" else SdpaCausalLm
+    model = model_cls(
+        vocab_size=args.vocab_size,
+        model_dim=256,
+        num_layers=args.num_layers,
+        num_heads=4,
+        ffn_dim=1024,
+        max_len=block_size,
+        dropout=0.1,
+    ).to(device)
+    model.loss_chunk_size = args.loss_chunk_size
+    model.checkpoint_every = checkpoint_every
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-3)
+    ids = torch.randint(0, args.vocab_size, (args.batch_size, block_size + 1), device=device)
+
+    def step() -> None:
+        optimizer.zero_grad()
+        model(ids[:, :-1], ids[:, 1:]).backward()
+        optimizer.step()
+
+    try:
+        step()  # allocate optimizer state outside the timed region
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        start = time.perf_counter()
+        for _ in range(args.steps):
+            step()
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+    except torch.cuda.OutOfMemoryError:
+        return math.inf, math.inf
+    return peak_memory_mb(device), (time.perf_counter() - start) / args.steps * 1e3
+
+
+def measure(args: argparse.Namespace, block_size: int, checkpoint_every: int) -> tuple[float, float]:
+    if args.device == "cuda":
+        return run(args, block_size, checkpoint_every)
+    proc = run_single(
+        __file__,
+        block_size=block_size,
+        checkpoint_every=checkpoint_every,
+        batch_size=args.batch_size,
+        model=args.model,
+        num_layers=args.num_layers,
+        vocab_size=args.vocab_size,
+        loss_chunk_size=args.loss_chunk_size,
+        steps=args.steps,
+        device=args.device,
+        seed=args.seed,
+    )
+    if proc.returncode != 0:
+        return math.inf, math.inf  # e.g. killed by the OOM killer
+    peak_mb, step_ms = proc.stdout.split()
+    return float(peak_mb), float(step_ms)
+
+
+def max_block_size(args: argparse.Namespace, checkpoint_every: int) -> int:
+    block_size, best = min(args.block_size), 0
+    while block_size <= args.search_max:
+        peak_mb, _ = measure(args, block_size, checkpoint_every)
+        if peak_mb > args.budget_mb:
+            break
+        best, block_size = block_size, block_size * 2
+    return best
+
+
+def main() -> None:
+    args = parse_args()
+    if args.single:
+        peak_mb, step_ms = run(args, args.block_size[0], args.checkpoint_every[0])
+        print(peak_mb, step_ms)
+        return
+    for block_size in args.block_size:
+        base = None
+        for every in args.checkpoint_every:
+            peak_mb, step_ms = measure(args, block_size, every)
+            base = base or (peak_mb, step_ms)
+            print(
+                f"block_size={block_size} checkpoint_every={every} peak_mb={peak_mb:.1f} step_ms={step_ms:.1f} "
+                f"memory={peak_mb / base[0]:.2f}x time={step_ms / base[1]:.2f}x",
+                flush=True,
+            )
+    if args.budget_mb > 0:
+        for every in args.checkpoint_every:
+            print(
+                f"budget_mb={args.budget_mb:g} checkpoint_every={every} max_block_size={max_block_size(args, every)}",
+                flush=True,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import argparse
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Report data-parallel (gloo) scaling efficiency of train.py. Extra arguments are passed "
+        "to train.py as Hydra overrides, e.g. task=nanochat task.data_dir=... optimizer=sam."
+    )
+    parser.add_argument("--ranks", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--threads-per-rank", type=int, default=1)
+    parser.add_argument("--max-steps", type=int, default=30)
+    args, overrides = parser.parse_known_args()
+    args.overrides = overrides
+    return args
+
+
+def steady_step_ms(ranks: int, args: argparse.Namespace) -> float:
+    cmd = [
+        sys.executable,
+        str(ROOT / "train.py"),
+        f"run.ddp_ranks={ranks}",
+        f"run.ddp_threads_per_rank={args.threads_per_rank}",
+        f"run.max_steps={args.max_steps}",
+        f"run.eval_every={args.max_steps + 1}",
+        "device=cpu",
+        *args.overrides,
+    ]
+    out = subprocess.run(cmd, check=True, capture_output=True, text=True, cwd=ROOT).stdout
+    match = re.search(r"steady_step_ms=([0-9.]+)", out)
+    if match is None:
+        raise RuntimeError(f"no steady_step_ms in train.py output:\n{out}")
+    return float(match.group(1))
+
+
+def main() -> None:
+    args = parse_args()
+    base = None
+    for ranks in args.ranks:
+        ms = steady_step_ms(ranks, args)
+        # run.batch_size is per rank, so samples per step grow with the rank count.
+        rate = ranks / ms
+        base = base or rate / ranks
+        print(
+            f"ranks={ranks} steady_step_ms={ms:.2f} speedup={rate / base:.2f}x efficiency={rate / (ranks * base):.2f}",
+            flush=True,
+        )
+
+
+if __name__ == "__main__":
+    main()
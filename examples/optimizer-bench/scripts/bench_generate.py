@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import torch
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from train import TinyCausalLm, sample_next_token  # noqa: E402
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Compare generated tokens/sec of KV-cached TinyCausalLm.generate against naive re-encoding."
+    )
+    parser.add_argument("--batch-size", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--prompt-len", type=int, default=16)
+    parser.add_argument("--new-tokens", type=int, default=112)
+    parser.add_argument("--vocab-size", type=int, default=50257)
+    parser.add_argument("--temperature", type=float, default=0.8)
+    parser.add_argument("--top-k", type=int, default=50)
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+
+@torch.no_grad()
+def generate_naive(model: TinyCausalLm, ids: torch.Tensor, new_tokens: int, temperature: float, top_k: int, generator) -> torch.Tensor:
+    for _ in range(new_tokens):
+        logits = model(ids)[:, -1]
+        ids = torch.cat([ids, sample_next_token(logits, temperature, top_k, generator)], dim=1)
+    return ids
+
+
+def timed(fn) -> tuple[torch.Tensor, float]:
+    start = time.perf_counter()
+    out = fn()
+    if out.is_cuda:
+        torch.cuda.synchronize(out.device)
+    return out, time.perf_counter() - start
+
+
+def main() -> None:
+    args = parse_args()
+    torch.manual_seed(args.seed)
+    device = torch.device(args.device)
+    model = TinyCausalLm(
+        vocab_size=args.vocab_size,
+        model_dim=256,
+        num_layers=4,
+        num_heads=4,
+        ffn_dim=1024,
+        max_len=args.prompt_len + args.new_tokens,
+        dropout=0.0,
+    ).to(device)
+    model.eval()
+
+    for batch_size in args.batch_size:
+        prompt = torch.randint(0, args.vocab_size, (batch_size, args.prompt_len), device=device)
+        # Same generator seed for both, so the sampled continuations should agree.
+        naive, naive_sec = timed(
+            lambda: generate_naive(
+                model, prompt, args.new_tokens, args.temperature, args.top_k, torch.Generator(device).manual_seed(args.seed)
+            )
+        )
+        cached, cached_sec = timed(
+            lambda: model.generate(
+                prompt, args.new_tokens, args.temperature, args.top_k, torch.Generator(device).manual_seed(args.seed)
+            )
+        )
+        tokens = batch_size * args.new_tokens
+        print(
+            f"batch_size={batch_size} naive_tokens_per_sec={tokens / naive_sec:.1f} "
+            f"cached_tokens_per_sec={tokens / cached_sec:.1f} speedup={naive_sec / cached_sec:.2f}x "
+            f"same_tokens={torch.equal(naive, cached)}"
+        )
+
+
+if __name__ == "__main__":
+    main()
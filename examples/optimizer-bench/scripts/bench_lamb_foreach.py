@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import argparse
+import copy
+import itertools
+import sys
+import time
+from pathlib import Path
+
+import torch
+import torch.nn as nn
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from optimizers import LAMB  # noqa: E402
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Compare LAMB step time for the per-tensor loop and the foreach path across tensor counts "
+        "and sizes. foreach only pays off when there are many small tensors."
+    )
+    parser.add_argument(
+        "--num-tensors",
+        type=int,
+        nargs="+",
+        default=[16, 64, 256],
+        help="Number of parameter tensors in the synthetic model.",
+    )
+    parser.add_argument(
+        "--tensor-size", type=int, nargs="+", default=[32, 256, 1024], help="Each tensor is tensor_size x tensor_size."
+    )
+    parser.add_argument("--steps", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+
+def make_params(num_tensors: int, size: int, device: torch.device) -> list[nn.Parameter]:
+    params = []
+    for i in range(num_tensors):
+        # Mix matrices and bias-like vectors so the norms see both shapes.
+        shape = (size, size) if i % 2 == 0 else (size,)
+        params.append(nn.Parameter(torch.randn(shape, device=device)))
+    return params
+
+
+def time_steps(params: list[nn.Parameter], grads: list[torch.Tensor], opt: LAMB, steps: int, warmup: int) -> float:
+    for p, g in zip(params, grads):
+        p.grad = g
+    for _ in range(warmup):
+        opt.step()
+    if params[0].is_cuda:
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(steps):
+        opt.step()
+    if params[0].is_cuda:
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / steps
+
+
+def main() -> None:
+    args = parse_args()
+    device = torch.device(args.device)
+
+    for size, n in itertools.product(args.tensor_size, args.num_tensors):
+        torch.manual_seed(args.seed)
+        loop_params = make_params(n, size, device)
+        foreach_params = copy.deepcopy(loop_params)
+        grads = [torch.randn_like(p) for p in loop_params]
+
+        loop_opt = LAMB(loop_params, lr=1e-3, weight_decay=0.01)
+        foreach_opt = LAMB(foreach_params, lr=1e-3, weight_decay=0.01, foreach=True)
+
+        loop_s = time_steps(loop_params, grads, loop_opt, args.steps, args.warmup)
+        foreach_s = time_steps(foreach_params, grads, foreach_opt, args.steps, args.warmup)
+
+        max_diff = max((a - b).abs().max().item() for a, b in zip(loop_params, foreach_params))
+        numel = sum(p.numel() for p in loop_params)
+        print(
+            f"tensor_size={size} tensors={n} params={numel} loop_ms={loop_s * 1e3:.3f} foreach_ms={foreach_s * 1e3:.3f} "
+            f"speedup={loop_s / foreach_s:.2f}x max_abs_diff={max_diff:.2e}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import torch
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bench_utils import peak_memory_mb, run_single  # noqa: E402
+from train import TinyCausalLm  # noqa: E402
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Compare peak memory and tokens/sec of the full-logits and chunked LM loss across batch sizes. "
+        "On CPU each configuration runs in a fresh process, since peak RSS is a per-process high-water mark."
+    )
+    parser.add_argument("--batch-size", type=int, nargs="+", default=[8, 16, 32])
+    parser.add_argument("--chunk-size", type=int, nargs="+", default=[0, 1024], help="0 = full logits.")
+    parser.add_argument("--block-size", type=int, default=128)
+    parser.add_argument("--vocab-size", type=int, default=50257)
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def run(args: argparse.Namespace, batch_size: int, chunk_size: int) -> str:
+    torch.manual_seed(args.seed)
+    device = torch.device(args.device)
+    if device.type == "cuda":
+        # Configs share the process on CUDA; start each from an empty high-water mark.
+        torch.cuda.empty_cache()
+        torch.cuda.reset_peak_memory_stats(device)
+    model = TinyCausalLm(
+        vocab_size=args.vocab_size,
+        model_dim=256,
+        num_layers=4,
+        num_heads=4,
+        ffn_dim=1024,
+        max_len=args.block_size,
+        dropout=0.0,
+    ).to(device)
+    model.loss_chunk_size = chunk_size
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-3)
+    ids = torch.randint(0, args.vocab_size, (batch_size, args.block_size + 1), device=device)
+
+    def step() -> None:
+        optimizer.zero_grad()
+        model(ids[:, :-1], ids[:, 1:]).backward()
+        optimizer.step()
+
+    setup_mb = peak_memory_mb(device)
+    step()  # allocate optimizer state outside the timed region
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    start = time.perf_counter()
+    for _ in range(args.steps):
+        step()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    elapsed = time.perf_counter() - start
+    tokens_per_sec = batch_size * args.block_size * args.steps / elapsed
+    label = "full" if chunk_size == 0 else f"chunk={chunk_size}"
+    return (
+        f"batch_size={batch_size} loss={label} peak_mb={peak_memory_mb(device):.1f} "
+        f"setup_mb={setup_mb:.1f} tokens_per_sec={tokens_per_sec:.1f}"
+    )
+
+
+def main() -> None:
+    args = parse_args()
+    if args.single:
+        print(run(args, args.batch_size[0], args.chunk_size[0]))
+        return
+    for batch_size in args.batch_size:
+        for chunk_size in args.chunk_size:
+            if args.device == "cuda":
+                print(run(args, batch_size, chunk_size), flush=True)
+                continue
+            proc = run_single(
+                __file__,
+                batch_size=batch_size,
+                chunk_size=chunk_size,
+                block_size=args.block_size,
+                vocab_size=args.vocab_size,
+                steps=args.steps,
+                device=args.device,
+                seed=args.seed,
+            )
+            proc.check_returncode()
+            print(proc.stdout.strip(), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from train import MemmapLmDataset, MemmapPrefetcher, build_batch_sampler  # noqa: E402
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Compare samples/sec of per-example, batched and prefetch-thread MemmapLmDataset loading, "
+        "and check that the prefetcher yields the DataLoader's batches while --grad-accum-steps of them are held."
+    )
+    parser.add_argument("--data", type=str, default=None, help="Path to a uint16 train.bin. Random tokens if omitted.")
+    parser.add_argument("--num-tokens", type=int, default=50_000_000, help="Size of the random corpus.")
+    parser.add_argument("--block-size", type=int, default=128)
+    parser.add_argument("--batch-size", type=int, nargs="+", default=[16, 64])
+    parser.add_argument("--num-examples", type=int, default=20_000)
+    parser.add_argument("--num-workers", type=int, default=0)
+    parser.add_argument("--grad-accum-steps", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+
+def samples_per_sec(loader) -> float:
+    start = time.perf_counter()
+    n = 0
+    for batch in loader:
+        n += batch["input_ids"].size(0)
+    return n / (time.perf_counter() - start)
+
+
+def held_batches_match(ds: MemmapLmDataset, batch_size: int, hold: int, steps: int = 20) -> bool:
+    """Whether groups of ``hold`` prefetched micro-batches, all held at once, equal the DataLoader's."""
+    torch.manual_seed(0)
+    loader = DataLoader(ds, batch_size=None, sampler=build_batch_sampler(ds, batch_size, shuffle=True))
+    expected = iter([batch["input_ids"] for batch, _ in zip(loader, range(steps * hold))])
+    torch.manual_seed(0)
+    prefetched = iter(MemmapPrefetcher(ds, batch_size, shuffle=True, depth=hold + 1, hold=hold))
+    for _ in range(steps):
+        held = [next(prefetched) for _ in range(hold)]
+        time.sleep(0.01)  # give the producer time to overwrite a slot it should not have
+        if not all(torch.equal(batch["input_ids"], next(expected)) for batch in held):
+            return False
+    return True
+
+
+def main() -> None:
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        data_path = args.data
+        if data_path is None:
+            data_path = str(Path(tmp) / "train.bin")
+            rng = np.random.default_rng(args.seed)
+            rng.integers(0, 50257, size=args.num_tokens, dtype=np.uint16).tofile(data_path)
+
+        ds = MemmapLmDataset(data_path, args.block_size, args.num_examples, seed=args.seed)
+        for bs in args.batch_size:
+            per_example = DataLoader(ds, batch_size=bs, shuffle=True, num_workers=args.num_workers)
+            batched = DataLoader(
+                ds,
+                batch_size=None,
+                sampler=build_batch_sampler(ds, bs, shuffle=True),
+                num_workers=args.num_workers,
+            )
+            prefetcher = MemmapPrefetcher(ds, bs, shuffle=True)
+            base = samples_per_sec(per_example)
+            fast = samples_per_sec(batched)
+            prefetched = samples_per_sec(prefetcher)
+            print(
+                f"batch_size={bs} per_example_samples_per_sec={base:.0f} "
+                f"batched_samples_per_sec={fast:.0f} prefetch_samples_per_sec={prefetched:.0f} "
+                f"speedup={fast / base:.2f}x/{prefetched / base:.2f}x "
+                f"held_batches_match={held_batches_match(ds, bs, args.grad_accum_steps)}"
+            )
+
+
+if __name__ == "__main__":
+    main()
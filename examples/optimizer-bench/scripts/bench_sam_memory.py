@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import torch
+import torch.nn.functional as F
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bench_utils import peak_memory_mb, run_single  # noqa: E402
+from optimizers import SAM  # noqa: E402
+from train import SmallCnn, TinyCausalLm  # noqa: E402
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Measure peak RSS and step time of SAM steps with reused perturbation buffers (reuse) and "
+        "with a fresh perturbation tensor per step, as SAM allocated before (per_step). Each implementation runs "
+        "in its own process, since peak RSS is a per-process high-water mark."
+    )
+    parser.add_argument("--model", choices=["cnn", "lm"], required=True)
+    parser.add_argument("--impl", choices=["per_step", "reuse"], nargs="+", default=["per_step", "reuse"])
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--block-size", type=int, default=128)
+    parser.add_argument("--vocab-size", type=int, default=50257)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+class PerStepSAM(SAM):
+    """Standard SAM as it ran before the perturbation buffers were reused.
+
+    Every step allocates ``e_w = grad * scale`` per parameter and parks it in
+    ``base_optimizer.state`` until ``second_step``; kept only as the baseline.
+    """
+
+    @torch.no_grad()
+    def first_step(self) -> bool:
+        norms = [torch.norm(p.grad, p=2) for p in self.params if p.grad is not None]
+        scale = self.rho / (torch.norm(torch.stack(norms), p=2) + self.eps)
+        for p in self.params:
+            if p.grad is None:
+                continue
+            e_w = p.grad * scale
+            p.add_(e_w)
+            self.base_optimizer.state[p]["_sam_e_w"] = e_w
+        return True
+
+    @torch.no_grad()
+    def second_step(self, base_step=None) -> None:
+        for p in self.params:
+            e_w = self.base_optimizer.state[p].pop("_sam_e_w", None)
+            if e_w is not None:
+                p.sub_(e_w)
+        self.base_optimizer.step()
+
+
+def run(args: argparse.Namespace, impl: str) -> str:
+    torch.manual_seed(args.seed)
+
+    if args.model == "cnn":
+        model = SmallCnn()
+        x = torch.randn(args.batch_size, 3, 32, 32)
+        y = torch.randint(0, 10, (args.batch_size,))
+
+        def loss_fn() -> torch.Tensor:
+            return F.cross_entropy(model(x), y)
+
+    else:
+        model = TinyCausalLm(
+            vocab_size=args.vocab_size,
+            model_dim=256,
+            num_layers=4,
+            num_heads=4,
+            ffn_dim=1024,
+            max_len=args.block_size,
+            dropout=0.0,
+        )
+        ids = torch.randint(0, args.vocab_size, (args.batch_size, args.block_size + 1))
+
+        def loss_fn() -> torch.Tensor:
+            logits = model(ids[:, :-1])
+            return F.cross_entropy(logits.view(-1, logits.size(-1)), ids[:, 1:].reshape(-1))
+
+    base = torch.optim.SGD(model.parameters(), lr=0.05, momentum=0.9)
+    sam_cls = PerStepSAM if impl == "per_step" else SAM
+    optimizer = sam_cls(model.parameters(), base_optimizer=base, rho=0.05)
+    rss_before = peak_memory_mb()
+
+    start = time.perf_counter()
+    for _ in range(args.steps):
+        optimizer.zero_grad()
+        loss_fn().backward()
+        if optimizer.first_step():
+            optimizer.zero_grad()
+            loss_fn().backward()
+        optimizer.second_step()
+    elapsed = time.perf_counter() - start
+
+    params_mb = sum(p.numel() * p.element_size() for p in model.parameters()) / 2**20
+    return (
+        f"model={args.model} impl={impl} params_mb={params_mb:.1f} peak_rss_mb={peak_memory_mb():.1f} "
+        f"setup_rss_mb={rss_before:.1f} step_ms={elapsed / args.steps * 1e3:.1f}"
+    )
+
+
+def main() -> None:
+    args = parse_args()
+    if args.single:
+        print(run(args, args.impl[0]))
+        return
+    peaks = {}
+    for impl in args.impl:
+        proc = run_single(
+            __file__,
+            model=args.model,
+            impl=impl,
+            steps=args.steps,
+            batch_size=args.batch_size,
+            block_size=args.block_size,
+            vocab_size=args.vocab_size,
+            seed=args.seed,
+        )
+        proc.check_returncode()
+        line = proc.stdout.strip()
+        print(line, flush=True)
+        peaks[impl] = float(dict(field.split("=") for field in line.split())["peak_rss_mb"])
+    if len(peaks) == 2:
+        print(f"model={args.model} peak_rss_saved_mb={peaks['per_step'] - peaks['reuse']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+"""Peak-memory measurement shared by the benchmark scripts."""
+
+from __future__ import annotations
+
+import subprocess
+import sys
+from pathlib import Path
+
+import torch
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from train import rss_mb  # noqa: E402
+
+
+def peak_memory_mb(device: torch.device | None = None) -> float:
+    """Peak CUDA memory allocated on ``device``, else the peak RSS of this process."""
+    if device is not None and device.type == "cuda":
+        return torch.cuda.max_memory_allocated(device) / 2**20
+    return rss_mb("VmHWM")
+
+
+def run_single(script: str, **options) -> subprocess.CompletedProcess:
+    """Run ``script --single --<option>=<value> ...`` in a fresh process.
+
+    The peak RSS is a per-process high-water mark, so on CPU each measured
+    configuration needs its own process.
+    """
+    cmd = [sys.executable, script, "--single"]
+    cmd += [f"--{name.replace('_', '-')}={value}" for name, value in options.items()]
+    return subprocess.run(cmd, capture_output=True, text=True)
@@ -7,10 +7,10 @@ if [[ -z "${NANOGPT_DATA_DIR:-}" ]]; then
   exit 1
 fi
 
-optimizers=(sgd_momentum adamw lamb adafactor sam muon)
+optimizers=(sgd_momentum adamw lamb adafactor sam muon muon_ns)
 for opt in "${optimizers[@]}"; do
   echo "=== NANOGPT_BIN | optimizer=${opt} ==="
-  python train.py task=nanochat task.data_dir="${NANOGPT_DATA_DIR}" optimizer=${opt} run.max_steps=150 run.eval_every=50 run.log_every=25 run.batch_size=16
+  python train.py task=nanochat task.data_dir="${NANOGPT_DATA_DIR}" optimizer=${opt} run.max_steps=150 run.eval_every=50 run.log_every=25 run.batch_size=16 "$@"
   echo
   sleep 1
 done
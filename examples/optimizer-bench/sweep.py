@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+import contextlib
+import copy
+import io
+import math
+import multiprocessing as mp
+import os
+from typing import Any
+
+import hydra
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from hydra import compose
+from hydra.core.hydra_config import HydraConfig
+from omegaconf import DictConfig
+from torch.func import functional_call, stack_module_state, vmap
+from torch.utils.data import DataLoader
+
+from train import (
+    _batch_iter,
+    autocast_context,
+    build_augment,
+    build_grad_scaler,
+    build_optimizer,
+    cache_eval_batches,
+    capture_rng_state,
+    eval_cifar,
+    eval_lm,
+    find_epoch_sampler,
+    load_task,
+    pin_cpu_slot,
+    print_run_header,
+    resolve_device,
+    restore_rng_state,
+    run_experiment,
+    set_seed,
+)
+
+# Populated in the parent before forking so pool workers inherit the loaded
+# data and the initial model without pickling them.
+_SHARED: dict[str, Any] = {}
+
+
+def compose_variant_cfg(variant: list[str]) -> DictConfig:
+    """Re-compose the run config with the CLI's overrides followed by ``variant``.
+
+    ``optimizer*`` overrides from the CLI are dropped: each sweep entry uses
+    its own yaml plus whatever ``variant`` sets.
+    """
+    overrides = [o for o in HydraConfig.get().overrides.task if not o.lstrip("+~").startswith("optimizer")]
+    return compose(config_name="config", overrides=overrides + list(variant))
+
+
+def run_one(
+    cfg: DictConfig,
+    initial_model: nn.Module,
+    train_loader: DataLoader,
+    val_loader: DataLoader,
+    device: torch.device,
+    rng_state: dict[str, Any],
+) -> None:
+    print(f"=== {cfg.task.name.upper()} | optimizer={cfg.optimizer.name} ===")
+    print_run_header(cfg, device)
+    # Same weights and RNG stream as a fresh `python train.py` process would see.
+    restore_rng_state(rng_state)
+    # The shared train_loader's EpochBlockSampler remembers where the previous run stopped.
+    sampler = find_epoch_sampler(train_loader)
+    if sampler is not None:
+        sampler.load_state_dict({"epoch": 0, "position": 0})
+    model = copy.deepcopy(initial_model)
+    run_experiment(cfg, model, train_loader, val_loader, device)
+    print()
+
+
+def _task_loss(task_name: str, output: torch.Tensor, target: torch.Tensor) -> torch.Tensor:
+    if task_name == "cifar10":
+        return F.cross_entropy(output, target)
+    return F.cross_entropy(output.reshape(-1, output.size(-1)), target.reshape(-1))
+
+
+def train_vmapped(
+    cfg: DictConfig,
+    cfgs: list[DictConfig],
+    initial_model: nn.Module,
+    train_loader: DataLoader,
+    val_loader: DataLoader,
+    device: torch.device,
+) -> None:
+    """Train one model copy per config as a single ``vmap``-ed model on shared batches.
+
+    ``stack_module_state`` stacks the copies' parameters into ``[N, ...]``
+    leaves, and each copy's parameters are re-pointed at its slice. Every
+    copy keeps its own optimizer from ``build_optimizer``; after the batched
+    backward each copy receives its slice of the stacked gradient and steps
+    in place, which updates the stacked tensors directly.
+    """
+    for i, c in enumerate(cfgs):
+        if c.optimizer.name == "sam":
+            raise ValueError(f"variant {i}: sam needs a per-copy second pass; use sweep.vmap=false")
+        if c.run.grad_accum_steps != 1:
+            raise ValueError(f"variant {i}: run.grad_accum_steps is not supported with sweep.vmap=true")
+        if c.optimizer.get("flat_state", False):
+            raise ValueError(f"variant {i}: flat_state re-points parameters and cannot share the stacked storage")
+
+    models = [copy.deepcopy(initial_model) for _ in cfgs]
+    params, buffers = stack_module_state(models)
+    named = [dict(m.named_parameters()) for m in models]
+    for name, stacked in params.items():
+        for i, copy_params in enumerate(named):
+            copy_params[name].data = stacked.data[i]
+    optimizers = [build_optimizer(c, m) for c, m in zip(cfgs, models)]
+    for i, c in enumerate(cfgs):
+        print(f"copy={i} ", end="")
+        print_run_header(c, device)
+
+    if cfg.run.eval_cache:
+        val_loader = cache_eval_batches(val_loader, device)
+    base = copy.deepcopy(initial_model).to("meta")
+    task_name = cfg.task.name
+
+    def loss_fn(p: dict, b: dict, inputs: torch.Tensor, target: torch.Tensor) -> torch.Tensor:
+        return _task_loss(task_name, functional_call(base, (p, b), (inputs,)), target)
+
+    # Same dropout masks for every copy, as if each had seen the same RNG stream.
+    batched_loss = vmap(loss_fn, in_dims=(0, 0, None, None), randomness="same")
+    scaler = build_grad_scaler(cfg.run.precision, device)
+    step_iter = _batch_iter(train_loader)
+    augment = build_augment(cfg, device) if task_name == "cifar10" else None
+
+    for m in models:
+        m.train()
+    for step in range(1, cfg.run.max_steps + 1):
+        batch = next(step_iter)
+        if task_name == "cifar10":
+            inputs, target = batch
+        else:
+            inputs, target = batch["input_ids"], batch["labels"]
+        inputs = inputs.to(device, non_blocking=True)
+        target = target.to(device, non_blocking=True)
+        if augment is not None:
+            inputs = augment(inputs)
+
+        for opt in optimizers:
+            opt.zero_grad()
+        for stacked in params.values():
+            stacked.grad = None
+        with autocast_context(cfg.run.precision, device):
+            losses = batched_loss(params, buffers, inputs, target)
+        # Copies are independent, so the gradient of the sum is each copy's own gradient.
+        scaler.scale(losses.sum()).backward()
+        for name, stacked in params.items():
+            for i, copy_params in enumerate(named):
+                copy_params[name].grad = stacked.grad[i]
+        for opt in optimizers:
+            scaler.step(opt)
+        scaler.update()
+
+        if step % cfg.run.log_every == 0:
+            for i, loss_value in enumerate(losses.tolist()):
+                if task_name == "cifar10":
+                    print(f"copy={i} step={step} train_loss={loss_value:.4f}")
+                else:
+                    print(f"copy={i} step={step} train_nll={loss_value:.4f} train_ppl={math.exp(min(20.0, loss_value)):.2f}")
+
+        if step % cfg.run.eval_every == 0:
+            _eval_copies(task_name, models, val_loader, device, f"step={step}")
+
+    _eval_copies(task_name, models, val_loader, device, "final")
+
+
+def _eval_copies(task_name: str, models: list[nn.Module], val_loader: DataLoader, device: torch.device, prefix: str) -> None:
+    evaluate = eval_cifar if task_name == "cifar10" else eval_lm
+    for i, m in enumerate(models):
+        val_loss, val_metric, eval_rate = evaluate(m, val_loader, device)
+        m.train()
+        if task_name == "cifar10":
+            print(f"copy={i} {prefix} val_loss={val_loss:.4f} val_acc={val_metric:.4f} eval_images_per_sec={eval_rate:.1f}")
+        else:
+            print(f"copy={i} {prefix} val_nll={val_loss:.4f} val_ppl={val_metric:.2f} eval_tokens_per_sec={eval_rate:.1f}")
+
+
+def _init_worker(slots: mp.Queue, threads: int) -> None:
+    pin_cpu_slot(slots.get(), threads)
+
+
+def _run_in_worker(name: str) -> str:
+    buf = io.StringIO()
+    with contextlib.redirect_stdout(buf):
+        run_one(_SHARED["cfgs"][name], *_SHARED["args"])
+    return buf.getvalue()
+
+
+@hydra.main(config_path="configs", config_name="config", version_base="1.3")
+def main(cfg: DictConfig) -> None:
+    """Train every optimizer in ``sweep.optimizers`` (or ``sweep.variants``) on data loaded once."""
+    if str(cfg.run.grad_accum_steps) == "auto":
+        raise ValueError("run.grad_accum_steps=auto is resolved by train.py; pass the batch_size/grad_accum_steps it prints")
+    if int(cfg.run.ddp_ranks) > 1 or int(os.environ.get("WORLD_SIZE", "1")) > 1:
+        raise ValueError("sweep.py trains in a single process; run train.py with run.ddp_ranks or torchrun for DDP")
+    set_seed(cfg.seed)
+    device = resolve_device(cfg.device)
+    initial_model, train_loader, val_loader = load_task(cfg)
+    initial_model.to(device)
+    rng_state = capture_rng_state()
+
+    if cfg.sweep.vmap:
+        variants = cfg.sweep.variants or [[f"optimizer={name}"] for name in cfg.sweep.optimizers]
+        cfgs = [compose_variant_cfg(v) for v in variants]
+        restore_rng_state(rng_state)
+        train_vmapped(cfg, cfgs, initial_model, train_loader, val_loader, device)
+        return
+
+    names = list(cfg.sweep.optimizers)
+    cfgs = {name: compose_variant_cfg([f"optimizer={name}"]) for name in names}
+    args = (initial_model, train_loader, val_loader, device, rng_state)
+
+    workers = int(cfg.sweep.workers)
+    if workers <= 1:
+        for name in names:
+            run_one(cfgs[name], *args)
+        return
+
+    if device.type != "cpu":
+        raise ValueError("sweep.workers > 1 forks worker processes and is CPU-only.")
+    threads = int(cfg.sweep.threads_per_worker) or max(1, (os.cpu_count() or 1) // workers)
+    _SHARED.update(cfgs=cfgs, args=args)
+    ctx = mp.get_context("fork")
+    slots = ctx.Queue()
+    for slot in range(workers):
+        slots.put(slot)
+    with ctx.Pool(workers, initializer=_init_worker, initargs=(slots, threads)) as pool:
+        # imap keeps sweep order, so output matches the sequential run.
+        for text in pool.imap(_run_in_worker, names):
+            print(text, end="")
+
+
+if __name__ == "__main__":
+    main()
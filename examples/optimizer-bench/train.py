@@ -1,23 +1,40 @@
 from __future__ import annotations
 
+import contextlib
+import copy
+import glob
+import itertools
 import math
+import mmap
+import multiprocessing as mp
 import os
 import pickle
+import queue
 import random
+import shutil
+import socket
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
 from typing import Any, Iterator
 
 import hydra
 import numpy as np
 import torch
+import torch.distributed as dist
 import torch.nn as nn
 import torch.nn.functional as F
 from omegaconf import DictConfig
-from torch.utils.data import DataLoader, Dataset, Subset
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.checkpoint import checkpoint
+from torch.utils.flop_counter import FlopCounterMode
+from torch.utils.data import BatchSampler, DataLoader, Dataset, RandomSampler, Sampler, SequentialSampler, Subset
 from torchvision import datasets as tv_datasets
 from torchvision import transforms
 from transformers import Adafactor
 
-from optimizers import LAMB, MuonLite, SAM
+from optimizers import LAMB, Muon, MuonLite, SAM, ZeroShardedOptimizer
 
 
 def set_seed(seed: int) -> None:
@@ -27,12 +44,94 @@ def set_seed(seed: int) -> None:
     torch.cuda.manual_seed_all(seed)
 
 
+def capture_rng_state() -> dict[str, Any]:
+    return {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+        "cuda": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+    }
+
+
+def restore_rng_state(state: dict[str, Any]) -> None:
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if state["cuda"] is not None:
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
 def resolve_device(device_cfg: str) -> torch.device:
     if device_cfg != "auto":
         return torch.device(device_cfg)
     return torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
 
+def dist_rank_world() -> tuple[int, int]:
+    """(rank, world size) of the data-parallel group, ``(0, 1)`` when not distributed."""
+    if dist.is_available() and dist.is_initialized():
+        return dist.get_rank(), dist.get_world_size()
+    return 0, 1
+
+
+def rank_slice(n: int) -> slice:
+    """Contiguous part of ``range(n)`` owned by this rank (all of it when not distributed)."""
+    rank, world = dist_rank_world()
+    return slice(rank * n // world, (rank + 1) * n // world)
+
+
+def pin_cpu_slot(slot: int, threads: int) -> None:
+    """Limit this process to ``threads`` torch threads on the ``slot``-th group of allowed CPUs."""
+    torch.set_num_threads(threads)
+    if hasattr(os, "sched_setaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+        pinned = cpus[slot * threads : (slot + 1) * threads]
+        if pinned:
+            os.sched_setaffinity(0, pinned)
+
+
+def autocast_context(precision: str, device: torch.device):
+    if precision == "fp32":
+        return contextlib.nullcontext()
+    if precision == "bf16":
+        return torch.autocast(device_type=device.type, dtype=torch.bfloat16)
+    if precision == "fp16":
+        return torch.autocast(device_type=device.type, dtype=torch.float16)
+    raise ValueError(f"Unknown precision: {precision}")
+
+
+def build_grad_scaler(precision: str, device: torch.device) -> torch.amp.GradScaler:
+    # A disabled scaler is a passthrough, so the training loops use it unconditionally.
+    return torch.amp.GradScaler(device.type, enabled=precision == "fp16")
+
+
+def enable_compile_cache(cache_dir: str) -> None:
+    """Point inductor's on-disk cache at a directory shared by every run of a sweep."""
+    cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+    os.makedirs(cache_dir, exist_ok=True)
+    # Importing torchvision already fills in inductor's default (/tmp/torchinductor_<user>),
+    # so only a directory exported by the user in the shell takes precedence.
+    unset: tuple[str | None, ...] = (None,)
+    try:
+        from torch._inductor.runtime.cache_dir_utils import default_cache_dir
+    except ImportError:
+        pass  # older torch: nothing fills the variable in on import
+    else:
+        unset += (default_cache_dir(),)
+    if os.environ.get("TORCHINDUCTOR_CACHE_DIR") in unset:
+        os.environ["TORCHINDUCTOR_CACHE_DIR"] = cache_dir
+    os.environ.setdefault("TORCHINDUCTOR_FX_GRAPH_CACHE", "1")
+    os.environ.setdefault("TORCHINDUCTOR_AUTOGRAD_CACHE", "1")
+
+
+def compile_optimizer_step(optimizer) -> None:
+    target = optimizer.base_optimizer if isinstance(optimizer, SAM) else optimizer
+    if isinstance(target, ZeroShardedOptimizer):
+        # Compile the local step only; the parameter all-gather stays eager.
+        target = target.optimizer
+    target.step = torch.compile(target.step, fullgraph=False)
+
+
 class SmallCnn(nn.Module):
     def __init__(self, num_classes: int = 10):
         super().__init__()
@@ -55,7 +154,148 @@ class SmallCnn(nn.Module):
         return self.net(x)
 
 
-class TinyCausalLm(nn.Module):
+class _ChunkedLinearCrossEntropy(torch.autograd.Function):
+    """Summed cross-entropy of ``hidden @ weight.T + bias`` computed ``chunk_size`` rows at a time.
+
+    The gradients w.r.t. ``hidden``, ``weight`` and ``bias`` are produced chunk
+    by chunk during the forward pass (softmax minus one-hot), so neither the
+    full logits nor their gradient are ever materialized or saved.
+    """
+
+    @staticmethod
+    def forward(ctx, hidden, weight, bias, labels, chunk_size):
+        grad_hidden = torch.empty_like(hidden)
+        grad_weight = torch.zeros_like(weight, dtype=torch.float32)
+        grad_bias = torch.zeros_like(bias, dtype=torch.float32) if bias is not None else None
+        total = hidden.new_zeros((), dtype=torch.float32)
+        for start in range(0, hidden.size(0), chunk_size):
+            h = hidden[start : start + chunk_size]
+            y = labels[start : start + chunk_size]
+            logits = F.linear(h, weight, bias).float()
+            lse = torch.logsumexp(logits, dim=-1)
+            total += (lse - logits.gather(1, y[:, None]).squeeze(1)).sum()
+            # d(sum CE)/d(logits) = softmax - one_hot, reusing the logits buffer.
+            probs = logits.sub_(lse[:, None]).exp_()
+            probs[torch.arange(len(y), device=y.device), y] -= 1.0
+            grad_hidden[start : start + chunk_size] = (probs.to(weight.dtype) @ weight).to(hidden.dtype)
+            grad_weight.add_(probs.t() @ h.float())
+            if grad_bias is not None:
+                grad_bias.add_(probs.sum(0))
+        ctx.save_for_backward(grad_hidden, grad_weight, grad_bias)
+        ctx.has_bias = bias is not None
+        return total
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        grad_hidden, grad_weight, grad_bias = ctx.saved_tensors
+        grad_bias = grad_bias * grad_output if ctx.has_bias else None
+        return grad_hidden * grad_output.to(grad_hidden.dtype), grad_weight * grad_output, grad_bias, None, None
+
+
+def chunked_cross_entropy(
+    hidden: torch.Tensor, head: nn.Linear, labels: torch.Tensor, chunk_size: int, reduction: str = "mean"
+) -> torch.Tensor:
+    """Cross-entropy of ``head(hidden)`` against ``labels`` without materializing full logits.
+
+    ``hidden`` is ``[N, D]`` and ``labels`` ``[N]``. Peak extra memory is one
+    ``[chunk_size, vocab]`` block instead of ``[N, vocab]`` (plus the logits
+    gradient when training).
+    """
+    if torch.is_grad_enabled() and (hidden.requires_grad or head.weight.requires_grad):
+        total = _ChunkedLinearCrossEntropy.apply(hidden, head.weight, head.bias, labels, chunk_size)
+    else:
+        total = sum(
+            F.cross_entropy(head(hidden[i : i + chunk_size]).float(), labels[i : i + chunk_size], reduction="sum")
+            for i in range(0, hidden.size(0), chunk_size)
+        )
+    return total / labels.numel() if reduction == "mean" else total
+
+
+def sample_next_token(
+    logits: torch.Tensor, temperature: float = 1.0, top_k: int | None = None, generator: torch.Generator | None = None
+) -> torch.Tensor:
+    """Sample ``[batch, 1]`` token ids from ``[batch, vocab]`` logits; ``temperature <= 0`` is greedy."""
+    if temperature <= 0:
+        return logits.argmax(dim=-1, keepdim=True)
+    logits = logits.float() / temperature
+    if top_k is not None and top_k < logits.size(-1):
+        kth = torch.topk(logits, top_k, dim=-1).values[:, -1:]
+        logits = logits.masked_fill(logits < kth, float("-inf"))
+    return torch.multinomial(torch.softmax(logits, dim=-1), 1, generator=generator)
+
+
+class _CausalLmBase(nn.Module):
+    """Loss and KV-cached generation shared by the LM models.
+
+    Subclasses provide ``hidden_states`` (final-norm features for a full
+    sequence), ``_new_cache`` and ``_decode`` (last-position logits for new
+    tokens at ``pos`` given a filled cache), plus ``lm_head`` and ``max_len``.
+    """
+
+    # >0: compute the loss with chunked_cross_entropy over this many tokens at a time.
+    loss_chunk_size = 0
+    # >0: recompute every k-th layer's activations during backward instead of storing them.
+    checkpoint_every = 0
+
+    def _run_layer(self, index: int, layer: nn.Module, *args) -> torch.Tensor:
+        if self.checkpoint_every > 0 and index % self.checkpoint_every == 0 and self.training and torch.is_grad_enabled():
+            # Non-reentrant checkpointing replays the saved RNG state, so dropout masks match.
+            return checkpoint(layer, *args, use_reentrant=False)
+        return layer(*args)
+
+    def forward(self, input_ids: torch.Tensor, labels: torch.Tensor | None = None, reduction: str = "mean") -> torch.Tensor:
+        """Logits ``[batch, seq, vocab]``, or the next-token loss when ``labels`` is given."""
+        x = self.hidden_states(input_ids)
+        if labels is not None and self.loss_chunk_size > 0:
+            return chunked_cross_entropy(
+                x.reshape(-1, x.size(-1)), self.lm_head, labels.reshape(-1), self.loss_chunk_size, reduction
+            )
+        logits = self.lm_head(x)
+        if labels is None:
+            return logits
+        return F.cross_entropy(logits.view(-1, logits.size(-1)), labels.reshape(-1), reduction=reduction)
+
+    @torch.no_grad()
+    def generate(
+        self,
+        input_ids: torch.Tensor,
+        max_new_tokens: int,
+        temperature: float = 1.0,
+        top_k: int | None = None,
+        generator: torch.Generator | None = None,
+    ) -> torch.Tensor:
+        """Extend ``[batch, prompt]`` ids by ``max_new_tokens`` sampled tokens using a KV cache.
+
+        The prompt is encoded once; each new token then costs one position of
+        attention against the cache instead of re-encoding the sequence.
+        """
+        bsz, prompt_len = input_ids.shape
+        if prompt_len + max_new_tokens > self.max_len:
+            raise ValueError(f"prompt {prompt_len} + {max_new_tokens} new tokens > max_len {self.max_len}")
+        was_training = self.training
+        self.eval()
+        cache = self._new_cache(bsz, prompt_len + max_new_tokens, input_ids.device)
+        out = [input_ids]
+        logits = self._decode(input_ids, cache, 0)
+        for pos in range(prompt_len, prompt_len + max_new_tokens):
+            token = sample_next_token(logits, temperature, top_k, generator)
+            out.append(token)
+            if pos + 1 < prompt_len + max_new_tokens:
+                logits = self._decode(token, cache, pos)
+        self.train(was_training)
+        return torch.cat(out, dim=1)
+
+    def _cache_buffers(
+        self, num_layers: int, shape: tuple[int, ...], device: torch.device
+    ) -> list[tuple[torch.Tensor, torch.Tensor]]:
+        dtype = self.lm_head.weight.dtype
+        return [
+            (torch.empty(shape, dtype=dtype, device=device), torch.empty(shape, dtype=dtype, device=device))
+            for _ in range(num_layers)
+        ]
+
+
+class TinyCausalLm(_CausalLmBase):
     def __init__(
         self,
         vocab_size: int,
@@ -80,47 +320,566 @@ class TinyCausalLm(nn.Module):
         self.norm = nn.LayerNorm(model_dim)
         self.lm_head = nn.Linear(model_dim, vocab_size)
         self.max_len = max_len
+        # Built once and sliced per sequence length instead of reallocated every forward.
+        self.register_buffer("causal_mask", torch.triu(torch.ones(max_len, max_len, dtype=torch.bool), diagonal=1), persistent=False)
 
-    def forward(self, input_ids: torch.Tensor) -> torch.Tensor:
+    def hidden_states(self, input_ids: torch.Tensor) -> torch.Tensor:
         bsz, seqlen = input_ids.shape
         if seqlen > self.max_len:
             raise ValueError(f"sequence length {seqlen} > max_len {self.max_len}")
         positions = torch.arange(seqlen, device=input_ids.device).unsqueeze(0).expand(bsz, -1)
         x = self.token_emb(input_ids) + self.pos_emb(positions)
-        mask = torch.triu(torch.ones(seqlen, seqlen, device=input_ids.device), diagonal=1).bool()
-        x = self.encoder(x, mask=mask)
-        x = self.norm(x)
-        return self.lm_head(x)
+        mask = self.causal_mask[:seqlen, :seqlen]
+        if self.checkpoint_every > 0:
+            # Same per-layer calls as nn.TransformerEncoder, so each layer can be checkpointed.
+            for i, layer in enumerate(self.encoder.layers):
+                x = self._run_layer(i, layer, x, mask, None, True)
+        else:
+            x = self.encoder(x, mask=mask, is_causal=True)
+        return self.norm(x)
+
+    def _new_cache(self, bsz: int, length: int, device: torch.device) -> list[tuple[torch.Tensor, torch.Tensor]]:
+        attn = self.encoder.layers[0].self_attn
+        shape = (bsz, attn.num_heads, length, attn.embed_dim // attn.num_heads)
+        return self._cache_buffers(len(self.encoder.layers), shape, device)
+
+    def _decode(self, input_ids: torch.Tensor, cache: list[tuple[torch.Tensor, torch.Tensor]], pos: int) -> torch.Tensor:
+        """Run ``input_ids`` (positions ``pos..``) through the encoder weights with a KV cache.
+
+        ``cache`` holds per-layer ``[batch, heads, length, head_dim]`` key/value
+        buffers filled in place. Returns the last position's logits. Mirrors the
+        post-norm ``nn.TransformerEncoderLayer`` forward in eval mode.
+        """
+        seqlen = input_ids.size(1)
+        positions = torch.arange(pos, pos + seqlen, device=input_ids.device)
+        x = self.token_emb(input_ids) + self.pos_emb(positions)
+        end = pos + seqlen
+        # SDPA boolean masks mark allowed positions; one new token may attend to everything cached.
+        mask = None if seqlen == 1 else ~self.causal_mask[pos:end, :end]
+        for layer, (keys, values) in zip(self.encoder.layers, cache):
+            attn = layer.self_attn
+            bsz, _, dim = x.shape
+            heads = attn.num_heads
+            qkv = F.linear(x, attn.in_proj_weight, attn.in_proj_bias)
+            q, k, v = qkv.view(bsz, seqlen, 3, heads, dim // heads).permute(2, 0, 3, 1, 4)
+            keys[:, :, pos:end] = k
+            values[:, :, pos:end] = v
+            out = F.scaled_dot_product_attention(q, keys[:, :, :end], values[:, :, :end], attn_mask=mask)
+            out = attn.out_proj(out.transpose(1, 2).reshape(bsz, seqlen, dim))
+            x = layer.norm1(x + out)
+            x = layer.norm2(x + layer.linear2(layer.activation(layer.linear1(x))))
+        return self.lm_head(self.norm(x[:, -1]))
+
+
+def rotary_tables(max_len: int, head_dim: int, base: float = 10000.0) -> tuple[torch.Tensor, torch.Tensor]:
+    """``cos``/``sin`` tables ``[max_len, head_dim // 2]`` for rotary position embeddings."""
+    inv_freq = 1.0 / (base ** (torch.arange(0, head_dim, 2, dtype=torch.float32) / head_dim))
+    angles = torch.outer(torch.arange(max_len, dtype=torch.float32), inv_freq)
+    return angles.cos(), angles.sin()
+
+
+def apply_rotary(x: torch.Tensor, cos: torch.Tensor, sin: torch.Tensor) -> torch.Tensor:
+    """Rotate ``[..., seq, head_dim]`` by per-position angles (half-split layout)."""
+    x1, x2 = x.chunk(2, dim=-1)
+    cos, sin = cos.to(x.dtype), sin.to(x.dtype)
+    return torch.cat([x1 * cos - x2 * sin, x1 * sin + x2 * cos], dim=-1)
+
+
+class SdpaBlock(nn.Module):
+    """Post-norm transformer block with a fused QKV projection and ``F.scaled_dot_product_attention``.
+
+    Same layout and dropout placement as ``nn.TransformerEncoderLayer`` (ReLU
+    FFN), but attention uses ``is_causal=True`` instead of an explicit mask.
+    """
+
+    def __init__(self, model_dim: int, num_heads: int, ffn_dim: int, dropout: float):
+        super().__init__()
+        self.num_heads = num_heads
+        self.attn_dropout = dropout
+        self.qkv = nn.Linear(model_dim, 3 * model_dim)
+        self.proj = nn.Linear(model_dim, model_dim)
+        self.linear1 = nn.Linear(model_dim, ffn_dim)
+        self.linear2 = nn.Linear(ffn_dim, model_dim)
+        self.norm1 = nn.LayerNorm(model_dim)
+        self.norm2 = nn.LayerNorm(model_dim)
+        self.dropout = nn.Dropout(dropout)
+        self.dropout1 = nn.Dropout(dropout)
+        self.dropout2 = nn.Dropout(dropout)
+
+    def forward(
+        self,
+        x: torch.Tensor,
+        rotary: tuple[torch.Tensor, torch.Tensor] | None = None,
+        cache: tuple[torch.Tensor, torch.Tensor] | None = None,
+        pos: int = 0,
+    ) -> torch.Tensor:
+        bsz, seqlen, dim = x.shape
+        q, k, v = self.qkv(x).view(bsz, seqlen, 3, self.num_heads, dim // self.num_heads).permute(2, 0, 3, 1, 4)
+        if rotary is not None:
+            cos, sin = rotary[0][pos : pos + seqlen], rotary[1][pos : pos + seqlen]
+            q, k = apply_rotary(q, cos, sin), apply_rotary(k, cos, sin)
+        if cache is not None:
+            if seqlen > 1 and pos > 0:
+                raise ValueError("multi-token decode is only supported from position 0")
+            keys, values = cache
+            keys[:, :, pos : pos + seqlen] = k
+            values[:, :, pos : pos + seqlen] = v
+            k, v = keys[:, :, : pos + seqlen], values[:, :, : pos + seqlen]
+        out = F.scaled_dot_product_attention(
+            q, k, v, dropout_p=self.attn_dropout if self.training else 0.0, is_causal=seqlen > 1
+        )
+        x = self.norm1(x + self.dropout1(self.proj(out.transpose(1, 2).reshape(bsz, seqlen, dim))))
+        return self.norm2(x + self.dropout2(self.linear2(self.dropout(F.relu(self.linear1(x))))))
+
+
+class SdpaCausalLm(_CausalLmBase):
+    """``TinyCausalLm`` counterpart built from ``SdpaBlock``s.
+
+    With ``rotary=True`` positions are rotary embeddings on queries/keys and
+    there is no ``pos_emb`` table.
+    """
+
+    def __init__(
+        self,
+        vocab_size: int,
+        model_dim: int,
+        num_layers: int,
+        num_heads: int,
+        ffn_dim: int,
+        max_len: int,
+        dropout: float,
+        rotary: bool = False,
+    ):
+        super().__init__()
+        self.token_emb = nn.Embedding(vocab_size, model_dim)
+        self.pos_emb = None if rotary else nn.Embedding(max_len, model_dim)
+        self.blocks = nn.ModuleList(SdpaBlock(model_dim, num_heads, ffn_dim, dropout) for _ in range(num_layers))
+        self.norm = nn.LayerNorm(model_dim)
+        self.lm_head = nn.Linear(model_dim, vocab_size)
+        self.max_len = max_len
+        self.num_heads = num_heads
+        if rotary:
+            cos, sin = rotary_tables(max_len, model_dim // num_heads)
+            self.register_buffer("rotary_cos", cos, persistent=False)
+            self.register_buffer("rotary_sin", sin, persistent=False)
+
+    def _embed(self, input_ids: torch.Tensor, pos: int) -> tuple[torch.Tensor, tuple[torch.Tensor, torch.Tensor] | None]:
+        x = self.token_emb(input_ids)
+        if self.pos_emb is None:
+            return x, (self.rotary_cos, self.rotary_sin)
+        return x + self.pos_emb(torch.arange(pos, pos + input_ids.size(1), device=input_ids.device)), None
+
+    def hidden_states(self, input_ids: torch.Tensor) -> torch.Tensor:
+        if input_ids.size(1) > self.max_len:
+            raise ValueError(f"sequence length {input_ids.size(1)} > max_len {self.max_len}")
+        x, rotary = self._embed(input_ids, 0)
+        for i, block in enumerate(self.blocks):
+            x = self._run_layer(i, block, x, rotary)
+        return self.norm(x)
+
+    def _new_cache(self, bsz: int, length: int, device: torch.device) -> list[tuple[torch.Tensor, torch.Tensor]]:
+        dim = self.token_emb.embedding_dim
+        return self._cache_buffers(len(self.blocks), (bsz, self.num_heads, length, dim // self.num_heads), device)
+
+    def _decode(self, input_ids: torch.Tensor, cache: list[tuple[torch.Tensor, torch.Tensor]], pos: int) -> torch.Tensor:
+        x, rotary = self._embed(input_ids, pos)
+        for block, layer_cache in zip(self.blocks, cache):
+            x = block(x, rotary, layer_cache, pos)
+        return self.lm_head(self.norm(x[:, -1]))
+
+
+def build_lm(cfg: DictConfig, vocab_size: int) -> _CausalLmBase:
+    """The LM selected by ``task.model``: ``encoder`` (``TinyCausalLm``) or ``sdpa`` (``SdpaCausalLm``)."""
+    kwargs = dict(
+        vocab_size=int(vocab_size),
+        model_dim=cfg.task.model_dim,
+        num_layers=cfg.task.num_layers,
+        num_heads=cfg.task.num_heads,
+        ffn_dim=cfg.task.ffn_dim,
+        max_len=int(cfg.task.block_size),
+        dropout=cfg.task.dropout,
+    )
+    if cfg.task.model == "encoder":
+        model = TinyCausalLm(**kwargs)
+    elif cfg.task.model == "sdpa":
+        model = SdpaCausalLm(**kwargs, rotary=cfg.task.rotary)
+    else:
+        raise ValueError(f"Unknown LM model: {cfg.task.model}")
+    model.loss_chunk_size = int(cfg.task.loss_chunk_size)
+    model.checkpoint_every = int(cfg.task.checkpoint_every)
+    return model
+
+
+def resolve_token_files(data_dir: str, spec: str) -> list[str]:
+    """Expand ``spec`` (a file, a directory of ``*.bin`` shards, or a glob) under ``data_dir``."""
+    path = os.path.join(data_dir, os.path.expanduser(spec))
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, "*.bin")))
+    if glob.has_magic(path):
+        return sorted(glob.glob(path))
+    return [path] if os.path.exists(path) else []
 
 
 class MemmapLmDataset(Dataset):
-    def __init__(self, data_path: str, block_size: int, num_examples: int, seed: int = 42):
-        self.data = np.memmap(data_path, dtype=np.uint16, mode="r")
+    """Next-token windows over one or more flat token memmaps.
+
+    ``data_path`` is a single ``.bin`` file or a list of shards, which are
+    addressed as one concatenated token space. Windows never cross a shard
+    boundary. At most ``max_open_shards`` memmaps are kept open (LRU).
+
+    ``sampling="random"`` draws ``num_examples`` window starts with
+    replacement. ``sampling="sequential"`` exposes every non-overlapping
+    window once (``num_examples`` is ignored); pair it with
+    ``EpochBlockSampler`` for exact epochs.
+    """
+
+    def __init__(
+        self,
+        data_path: str | list[str],
+        block_size: int,
+        num_examples: int,
+        seed: int = 42,
+        sampling: str = "random",
+        dtype: np.dtype = np.uint16,
+        max_open_shards: int = 8,
+    ):
+        self.paths = [data_path] if isinstance(data_path, str) else list(data_path)
+        self.dtype = np.dtype(dtype)
         self.block_size = int(block_size)
-        self.max_start = len(self.data) - self.block_size - 1
+        self.max_open_shards = max(1, int(max_open_shards))
+        self._open: OrderedDict[int, np.memmap] = OrderedDict()
+        # Random windows defeat kernel readahead; tell the kernel not to bother.
+        self._open_advice = getattr(mmap, "MADV_RANDOM", None) if sampling == "random" else None
+
+        lengths = np.array([os.path.getsize(p) // self.dtype.itemsize for p in self.paths], dtype=np.int64)
+        self.shard_offsets = np.concatenate([[0], np.cumsum(lengths)])
+        # Per shard, starts 0 .. len - block_size - 2 are valid (as for a single file).
+        valid = np.maximum(lengths - self.block_size - 1, 0)
+        self.max_start = int(valid.sum())
         if self.max_start <= 0:
             raise RuntimeError(
-                f"Not enough tokens in {data_path} for block_size={self.block_size}. "
-                f"Need at least {self.block_size + 2} tokens."
+                f"Not enough tokens in {self.paths[0] if len(self.paths) == 1 else f'{len(self.paths)} shards'} "
+                f"for block_size={self.block_size}. Need at least {self.block_size + 2} tokens in one file."
             )
-        if num_examples <= 0:
-            raise RuntimeError("num_examples must be > 0 for memmap sampling.")
-        rng = np.random.default_rng(seed)
-        # Sampling with replacement keeps memory bounded and works for any corpus size.
-        self.starts = rng.integers(0, self.max_start, size=num_examples, endpoint=False)
+        if sampling == "sequential":
+            self.starts = np.concatenate(
+                [off + np.arange(0, v + 1, self.block_size) for off, v in zip(self.shard_offsets[:-1], valid) if v > 0]
+            )
+        elif sampling == "random":
+            if num_examples <= 0:
+                raise RuntimeError("num_examples must be > 0 for memmap sampling.")
+            rng = np.random.default_rng(seed)
+            # Sampling with replacement keeps memory bounded and works for any corpus size.
+            draws = rng.integers(0, self.max_start, size=num_examples, endpoint=False)
+            valid_offsets = np.concatenate([[0], np.cumsum(valid)])
+            shard = np.searchsorted(valid_offsets, draws, side="right") - 1
+            self.starts = self.shard_offsets[shard] + (draws - valid_offsets[shard])
+        else:
+            raise ValueError(f"Unknown memmap sampling mode: {sampling}")
+        self.window = np.arange(self.block_size + 1)
+
+    def __getstate__(self) -> dict[str, Any]:
+        # Worker processes reopen shards lazily instead of pickling memmaps.
+        state = self.__dict__.copy()
+        state["_open"] = OrderedDict()
+        return state
 
     def __len__(self) -> int:
         return len(self.starts)
 
-    def __getitem__(self, idx: int) -> dict[str, torch.Tensor]:
-        start = int(self.starts[idx])
-        chunk = np.asarray(self.data[start : start + self.block_size + 1], dtype=np.int64)
+    def __getitem__(self, idx: int | list[int]) -> dict[str, torch.Tensor]:
+        if not isinstance(idx, (int, np.integer)):
+            return self.get_batch(idx)
+        shard, local = self._locate(int(self.starts[idx]))
+        chunk = np.asarray(self._shard(shard)[local : local + self.block_size + 1], dtype=np.int64)
         ids = torch.from_numpy(chunk)
         return {
             "input_ids": ids[:-1],
             "labels": ids[1:],
         }
 
+    def _locate(self, start: int) -> tuple[int, int]:
+        shard = int(np.searchsorted(self.shard_offsets, start, side="right")) - 1
+        return shard, start - int(self.shard_offsets[shard])
+
+    def _shard(self, shard: int) -> np.memmap:
+        data = self._open.get(shard)
+        if data is not None:
+            self._open.move_to_end(shard)
+            return data
+        data = np.memmap(self.paths[shard], dtype=self.dtype, mode="r")
+        self._open[shard] = data
+        self._advise_shard(shard, self._open_advice, 0, len(data))
+        while len(self._open) > self.max_open_shards:
+            self._open.popitem(last=False)
+        return data
+
+    def _advise_shard(self, shard: int, advice: int | None, start: int, num_tokens: int) -> None:
+        mm = getattr(self._open.get(shard), "_mmap", None)
+        if advice is None or mm is None or not hasattr(mm, "madvise"):
+            return
+        itemsize = self.dtype.itemsize
+        start_byte = start * itemsize
+        aligned = start_byte - start_byte % mmap.PAGESIZE
+        end = min(len(mm), (start + num_tokens) * itemsize)
+        try:
+            mm.madvise(advice, aligned, end - aligned)
+        except OSError:
+            pass
+
+    def advise(self, advice: int | None, start_token: int = 0, num_tokens: int | None = None) -> None:
+        """Best-effort ``madvise`` on a global token range; a no-op where unsupported."""
+        end_token = int(self.shard_offsets[-1]) if num_tokens is None else start_token + num_tokens
+        first, _ = self._locate(start_token)
+        for shard in range(first, len(self.paths)):
+            lo, hi = int(self.shard_offsets[shard]), int(self.shard_offsets[shard + 1])
+            if lo >= end_token:
+                break
+            begin = max(start_token, lo) - lo
+            self._shard(shard)
+            self._advise_shard(shard, advice, begin, min(end_token, hi) - lo - begin)
+
+    def read_windows(self, starts: np.ndarray, out: np.ndarray, index: np.ndarray | None = None) -> np.ndarray:
+        """Copy the windows at global token offsets ``starts`` into ``out`` (``[n, block_size + 1]``).
+
+        ``index`` is an int64 scratch array of at least ``out``'s shape; pass
+        one to reuse it across batches instead of allocating per call.
+        """
+        n = len(starts)
+        if len(self.paths) == 1:
+            shard, local = 0, starts
+        else:
+            shards = np.searchsorted(self.shard_offsets, starts, side="right") - 1
+            if (shards != shards[0]).any():
+                # Windows are contiguous in their shard: copy each slice straight into ``out``.
+                for row, (shard, start) in enumerate(zip(shards, starts)):
+                    lo = int(start - self.shard_offsets[shard])
+                    out[row] = self._shard(int(shard))[lo : lo + self.block_size + 1]
+                return out
+            shard = int(shards[0])
+            local = starts - self.shard_offsets[shard]
+        if index is None:
+            index = np.empty(out.shape, dtype=np.int64)
+        np.add(local[:, None], self.window, out=index[:n])
+        return np.take(self._shard(shard), index[:n], out=out)
+
+    def get_batch(self, indices: list[int]) -> dict[str, torch.Tensor]:
+        """Gather a whole batch of windows with one fancy-index per shard."""
+        starts = self.starts[np.asarray(indices)]
+        raw = self.read_windows(starts, np.empty((len(starts), self.block_size + 1), dtype=self.dtype))
+        ids = torch.from_numpy(raw.astype(np.int64))
+        return {
+            "input_ids": ids[:, :-1],
+            "labels": ids[:, 1:],
+        }
+
+
+class EpochBlockSampler(Sampler[int]):
+    """Exact-epoch order over a ``sampling="sequential"`` ``MemmapLmDataset``.
+
+    Windows are grouped into I/O blocks of ``io_block_tokens`` contiguous
+    tokens. Each epoch visits the blocks in a permutation seeded by
+    ``(seed, epoch)`` and shuffles windows only within a block, so reads stay
+    local to one region of the file. The next block is prefetched with
+    ``MADV_WILLNEED`` while the current one is consumed. ``state_dict`` /
+    ``load_state_dict`` resume from an (epoch, position) pair.
+    """
+
+    def __init__(self, dataset: MemmapLmDataset, seed: int, io_block_tokens: int = 1 << 20):
+        self.dataset = dataset
+        self.seed = int(seed)
+        self.windows_per_block = max(1, int(io_block_tokens) // dataset.block_size)
+        self.epoch = 0
+        self.position = 0
+
+    def __len__(self) -> int:
+        return len(self.dataset) - self.position
+
+    def epoch_blocks(self, epoch: int) -> list[np.ndarray]:
+        """Window indices of ``epoch``, one array per I/O block in visiting order."""
+        n = len(self.dataset)
+        rng = np.random.default_rng((self.seed, epoch))
+        num_blocks = math.ceil(n / self.windows_per_block)
+        blocks = []
+        for block in rng.permutation(num_blocks):
+            lo = int(block) * self.windows_per_block
+            hi = min(n, lo + self.windows_per_block)
+            blocks.append(lo + rng.permutation(hi - lo))
+        return blocks
+
+    def _prefetch(self, block: np.ndarray) -> None:
+        first = int(self.dataset.starts[block.min()])
+        last = int(self.dataset.starts[block.max()])
+        self.dataset.advise(getattr(mmap, "MADV_WILLNEED", None), first, last - first + self.dataset.block_size + 1)
+
+    def __iter__(self) -> Iterator[int]:
+        blocks = self.epoch_blocks(self.epoch)
+        seen = 0
+        started = False
+        for k, block in enumerate(blocks):
+            if seen + len(block) <= self.position:
+                seen += len(block)
+                continue
+            if not started:
+                self._prefetch(block)
+                started = True
+            if k + 1 < len(blocks):
+                self._prefetch(blocks[k + 1])
+            for idx in block:
+                if seen >= self.position:
+                    self.position = seen + 1
+                    yield int(idx)
+                seen += 1
+        self.epoch += 1
+        self.position = 0
+
+    def state_dict(self) -> dict[str, int]:
+        return {"epoch": self.epoch, "position": self.position}
+
+    def load_state_dict(self, state: dict[str, int]) -> None:
+        self.epoch = int(state["epoch"])
+        self.position = int(state["position"])
+
+
+class ResumableBatchSampler(BatchSampler):
+    """``BatchSampler`` whose next pass can start ``skip`` batches in.
+
+    The skipped index batches are still drawn from the underlying sampler, so
+    the RNG use is unchanged, but the loader never fetches their data.
+    """
+
+    skip = 0
+
+    def __iter__(self) -> Iterator[list[int]]:
+        # Read ``skip`` on the first batch, not here: multi-worker DataLoader iterators call iter() twice.
+        skip, self.skip = self.skip, 0
+        yield from itertools.islice(super().__iter__(), skip, None)
+
+
+def build_batch_sampler(
+    dataset: Dataset, batch_size: int, shuffle: bool, sampler: Sampler | None = None
+) -> ResumableBatchSampler:
+    """Index batches for a DataLoader (``batch_sampler=``) or a batch-fetching dataset.
+
+    For datasets that fetch a whole batch per ``__getitem__`` pass it as
+    ``sampler=`` with ``batch_size=None``. Without an explicit ``sampler``,
+    draws the same order as ``DataLoader(batch_size=..., shuffle=...)``.
+    """
+    if sampler is None:
+        sampler = RandomSampler(dataset) if shuffle else SequentialSampler(dataset)
+    return ResumableBatchSampler(sampler, batch_size=batch_size, drop_last=False)
+
+
+class MemmapPrefetcher:
+    """In-process replacement for the DataLoader over a ``MemmapLmDataset``.
+
+    A background thread gathers batches straight from the memmap into a ring
+    of preallocated int64 buffers (pinned when CUDA is available), so nothing
+    is pickled between processes and no tensors are allocated per step. The
+    last ``hold`` yielded batches stay valid (set it to the number of
+    micro-batches a step holds at once); older slots go back to the producer,
+    also across epochs. On CUDA a returned slot is refilled only after the
+    work queued on the consumer's stream so far has finished, so a
+    ``non_blocking`` copy out of it never races the producer (``eval_lm``
+    does not sync per batch).
+    """
+
+    def __init__(
+        self,
+        dataset: MemmapLmDataset,
+        batch_size: int,
+        shuffle: bool,
+        depth: int = 4,
+        sampler: Sampler | None = None,
+        hold: int = 1,
+    ):
+        if depth < hold + 1:
+            raise ValueError(f"prefetch depth must be >= {hold + 1} ({hold} batches in use, one being filled)")
+        self.dataset = dataset
+        self.hold = int(hold)
+        self.batch_size = int(batch_size)
+        self.sampler = sampler
+        self.batch_sampler = build_batch_sampler(dataset, self.batch_size, shuffle, sampler)
+        shape = (self.batch_size, dataset.block_size + 1)
+        pin = torch.cuda.is_available()
+        self.buffers = [torch.empty(shape, dtype=torch.int64, pin_memory=pin) for _ in range(depth)]
+        # Only the producer thread touches these scratch arrays.
+        self._index = np.empty(shape, dtype=np.int64)
+        self._raw = np.empty(shape, dtype=dataset.dtype)
+        # (slot, CUDA event or None) pairs the producer may refill, and the slots still held.
+        self._free: queue.Queue = queue.Queue()
+        for slot in range(depth):
+            self._free.put((slot, None))
+        self._held: deque[int] = deque()
+
+    def __len__(self) -> int:
+        return len(self.batch_sampler)
+
+    def __iter__(self) -> Iterator[dict[str, torch.Tensor]]:
+        # DataLoader draws a worker seed before shuffling; do the same so the
+        # batch order matches the DataLoader path for a given seed.
+        torch.empty((), dtype=torch.int64).random_()
+        batch_iter = iter(self.batch_sampler)
+        # Pull the first batch here so RandomSampler draws its seed from the
+        # torch RNG on this thread, not concurrently with training.
+        first = next(batch_iter, None)
+        batches = itertools.chain([first], batch_iter) if first is not None else iter(())
+        ready: queue.Queue = queue.Queue()
+        stop = threading.Event()
+        producer = threading.Thread(target=self._produce, args=(batches, ready, stop), daemon=True)
+        producer.start()
+
+        try:
+            while True:
+                item = ready.get()
+                if item is None:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                slot, n = item
+                self._held.append(slot)
+                while len(self._held) > self.hold:
+                    self._release(self._held.popleft())
+                buf = self.buffers[slot][:n]
+                yield {"input_ids": buf[:, :-1], "labels": buf[:, 1:]}
+        finally:
+            stop.set()
+            producer.join()
+            # Slots filled but never yielded (iteration stopped early) go straight back.
+            while not ready.empty():
+                item = ready.get_nowait()
+                if isinstance(item, tuple):
+                    self._free.put((item[0], None))
+
+    def _release(self, slot: int) -> None:
+        event = None
+        if self.buffers[slot].is_pinned():
+            # Marks the end of any device copy already queued from this slot.
+            event = torch.cuda.Event()
+            event.record()
+        self._free.put((slot, event))
+
+    def _produce(self, batches: Iterator[list[int]], ready: queue.Queue, stop: threading.Event) -> None:
+        try:
+            for indices in batches:
+                slot = None
+                while slot is None:
+                    if stop.is_set():
+                        return
+                    try:
+                        slot, event = self._free.get(timeout=0.1)
+                    except queue.Empty:
+                        pass
+                if event is not None:
+                    event.synchronize()
+                n = len(indices)
+                self.dataset.read_windows(self.dataset.starts[indices], self._raw[:n], self._index)
+                np.copyto(self.buffers[slot].numpy()[:n], self._raw[:n])
+                ready.put((slot, n))
+            ready.put(None)
+        except BaseException as exc:  # surface producer errors in the training thread
+            ready.put(exc)
+
 
 def _batch_iter(loader: DataLoader) -> Iterator[Any]:
     while True:
@@ -128,23 +887,256 @@ def _batch_iter(loader: DataLoader) -> Iterator[Any]:
             yield batch
 
 
+def find_epoch_sampler(loader) -> EpochBlockSampler | None:
+    """The ``EpochBlockSampler`` behind ``loader`` (directly or inside a ``BatchSampler``), if any."""
+    sampler = getattr(loader, "batch_sampler", None) or getattr(loader, "sampler", None)
+    while sampler is not None and not isinstance(sampler, EpochBlockSampler):
+        sampler = getattr(sampler, "sampler", None)
+    return sampler
+
+
+def find_batch_skipper(loader):
+    """The object behind ``loader`` with a ``skip`` attribute (the loader or its ``ResumableBatchSampler``), if any."""
+    for candidate in (loader, getattr(loader, "batch_sampler", None), getattr(loader, "sampler", None)):
+        if hasattr(candidate, "skip"):
+            return candidate
+    return None
+
+
+class ResumableBatches:
+    """``_batch_iter`` whose position can be saved and restored.
+
+    Every loader here draws its shuffle seed from the torch RNG when an
+    epoch's first batch is requested. The position is therefore the torch RNG
+    state at that moment, the ``EpochBlockSampler`` state (if any) and the
+    number of batches consumed since. ``load_state_dict`` replays the epoch
+    start's RNG draws, then skips the consumed batches in the index sampler
+    (or moves the ``EpochBlockSampler`` past them) without fetching their
+    data. The caller restores the global RNG state afterwards.
+    """
+
+    def __init__(self, loader):
+        self.loader = loader
+        self.sampler = find_epoch_sampler(loader)
+        self.skipper = find_batch_skipper(loader)
+        self.consumed = 0
+        self._epoch_start: dict[str, Any] | None = None
+        self._it: Iterator[Any] | None = None
+        self._pending: list[Any] = []
+
+    def __iter__(self) -> ResumableBatches:
+        return self
+
+    def __next__(self) -> Any:
+        if self._pending:
+            self.consumed += 1
+            return self._pending.pop()
+        while True:
+            if self._it is None:
+                self._epoch_start = {
+                    "rng": torch.get_rng_state(),
+                    "sampler": None if self.sampler is None else self.sampler.state_dict(),
+                }
+                self._it = iter(self.loader)
+                self.consumed = 0
+            try:
+                batch = next(self._it)
+            except StopIteration:
+                self._it = None
+                continue
+            self.consumed += 1
+            return batch
+
+    def state_dict(self) -> dict[str, Any] | None:
+        if self._epoch_start is None:
+            return None
+        return {**self._epoch_start, "consumed": self.consumed}
+
+    def load_state_dict(self, state: dict[str, Any] | None) -> None:
+        if state is None:
+            return
+        if self.skipper is None:
+            raise TypeError(f"{type(self.loader).__name__} cannot skip batches; build it with build_batch_sampler")
+        if self.sampler is not None:
+            # The loader may draw indices ahead of training, so derive the position from the batch count.
+            position = state["sampler"]["position"] + state["consumed"] * self.skipper.batch_size
+            self.sampler.load_state_dict({"epoch": state["sampler"]["epoch"], "position": position})
+        else:
+            self.skipper.skip = state["consumed"]
+        torch.set_rng_state(state["rng"])
+        self._epoch_start = {"rng": state["rng"], "sampler": state["sampler"]}
+        self._it = iter(self.loader)
+        self.consumed = state["consumed"]
+        # Fetch the next batch now so any lazy shuffle-seed draw still sees the epoch's RNG.
+        self._pending = []
+        try:
+            self._pending.append(next(self._it))
+        except StopIteration:
+            self._it = None
+
+
+CIFAR_MEAN = (0.4914, 0.4822, 0.4465)
+CIFAR_STD = (0.2470, 0.2435, 0.2616)
+
+
+def _save_npy(path: str, array: np.ndarray) -> None:
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp, path)
+
+
+def build_cifar_cache(root: str, train: bool, dtype: str = "uint8") -> tuple[np.ndarray, np.ndarray]:
+    """Decode a CIFAR-10 split once into ``.npy`` files under ``root`` and memory-map them.
+
+    ``uint8`` stores raw NCHW pixels (normalized per batch by the loader);
+    ``float16`` stores pixels already normalized with ``CIFAR_MEAN``/``CIFAR_STD``.
+    """
+    if dtype not in ("uint8", "float16"):
+        raise ValueError(f"Unknown CIFAR cache dtype: {dtype}")
+    split = "train" if train else "test"
+    images_path = os.path.join(root, f"cifar10_{split}_{dtype}.npy")
+    labels_path = os.path.join(root, f"cifar10_{split}_labels.npy")
+    if not (os.path.exists(images_path) and os.path.exists(labels_path)):
+        ds = tv_datasets.CIFAR10(root=root, train=train, download=True)
+        images = np.ascontiguousarray(ds.data.transpose(0, 3, 1, 2))  # NHWC -> NCHW
+        if dtype == "float16":
+            mean = np.array(CIFAR_MEAN, dtype=np.float32)[:, None, None]
+            std = np.array(CIFAR_STD, dtype=np.float32)[:, None, None]
+            images = ((images.astype(np.float32) / 255.0 - mean) / std).astype(np.float16)
+        os.makedirs(root, exist_ok=True)
+        _save_npy(images_path, images)
+        _save_npy(labels_path, np.asarray(ds.targets, dtype=np.int64))
+    return np.load(images_path, mmap_mode="r"), np.load(labels_path, mmap_mode="r")
+
+
+class CifarTensorLoader:
+    """Image batches sliced from one in-memory tensor instead of a DataLoader.
+
+    Each batch is a single ``index_select`` (or a contiguous slice when not
+    shuffling), so there are no per-sample transforms and no worker
+    processes. The per-epoch permutation is drawn from the torch RNG exactly
+    as ``DataLoader(shuffle=True)`` does, so ``cfg.seed`` fixes the order and
+    it matches the DataLoader path batch for batch.
+    """
+
+    def __init__(self, images: np.ndarray, labels: np.ndarray, batch_size: int, shuffle: bool):
+        # Copy out of the (read-only) cache memmap: torch warns on non-writable arrays.
+        self.images = torch.from_numpy(np.array(images))
+        self.labels = torch.from_numpy(np.array(labels, dtype=np.int64))
+        self.batch_size = int(batch_size)
+        self.shuffle = shuffle
+        # Batches to leave out at the start of the next pass (used when resuming).
+        self.skip = 0
+        self.mean = torch.tensor(CIFAR_MEAN).view(1, 3, 1, 1)
+        self.std = torch.tensor(CIFAR_STD).view(1, 3, 1, 1)
+
+    def __len__(self) -> int:
+        return math.ceil(len(self.labels) / self.batch_size)
+
+    def __iter__(self) -> Iterator[tuple[torch.Tensor, torch.Tensor]]:
+        n = len(self.labels)
+        # Worker seed draw, then RandomSampler's seed: same RNG use as DataLoader.
+        torch.empty((), dtype=torch.int64).random_()
+        order = None
+        if self.shuffle:
+            seed = int(torch.empty((), dtype=torch.int64).random_().item())
+            order = torch.randperm(n, generator=torch.Generator().manual_seed(seed))
+        skip, self.skip = self.skip, 0
+        for start in range(skip * self.batch_size, n, self.batch_size):
+            if order is None:
+                x, y = self.images[start : start + self.batch_size], self.labels[start : start + self.batch_size]
+            else:
+                idx = order[start : start + self.batch_size]
+                x, y = self.images.index_select(0, idx), self.labels.index_select(0, idx)
+            yield self._prepare(x), y
+
+    def _prepare(self, x: torch.Tensor) -> torch.Tensor:
+        if x.dtype != torch.uint8:
+            return x.float()
+        # Same ops in the same order as ToTensor + Normalize.
+        return x.float().div_(255).sub_(self.mean).div_(self.std)
+
+
+class BatchAugment:
+    """Random crop with zero padding, horizontal flip and cutout on a whole NCHW batch.
+
+    Crop and flip are a single gather from a padded copy of the batch and
+    cutout is a single mask multiply, so the cost does not grow with Python
+    per-sample work. Zero padding/cutout equals the dataset mean on
+    normalized inputs. Draws come from a private generator seeded once, so
+    augmentation is reproducible and leaves the global RNG untouched.
+    """
+
+    def __init__(self, crop_padding: int, flip: bool, cutout: int, seed: int, device: torch.device):
+        self.crop_padding = int(crop_padding)
+        self.flip = bool(flip)
+        self.cutout = int(cutout)
+        self.device = device
+        self.generator = torch.Generator(device=device).manual_seed(int(seed))
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        n, c, h, w = x.shape
+        pad, g, dev = self.crop_padding, self.generator, x.device
+        rows = torch.arange(h, device=dev).expand(n, h)
+        cols = torch.arange(w, device=dev).expand(n, w)
+        if pad > 0:
+            x = F.pad(x, (pad, pad, pad, pad))
+            rows = rows + torch.randint(0, 2 * pad + 1, (n, 1), generator=g, device=dev)
+            cols = cols + torch.randint(0, 2 * pad + 1, (n, 1), generator=g, device=dev)
+        if self.flip:
+            flipped = torch.rand(n, 1, generator=g, device=dev) < 0.5
+            cols = torch.where(flipped, cols.flip(1), cols)
+        if pad > 0 or self.flip:
+            batch_idx = torch.arange(n, device=dev).view(n, 1, 1, 1)
+            chan_idx = torch.arange(c, device=dev).view(1, c, 1, 1)
+            x = x[batch_idx, chan_idx, rows[:, None, :, None], cols[:, None, None, :]]
+        if self.cutout > 0:
+            top = torch.randint(0, h, (n, 1, 1), generator=g, device=dev) - self.cutout // 2
+            left = torch.randint(0, w, (n, 1, 1), generator=g, device=dev) - self.cutout // 2
+            ys = torch.arange(h, device=dev).view(1, h, 1)
+            xs = torch.arange(w, device=dev).view(1, 1, w)
+            inside = (ys >= top) & (ys < top + self.cutout) & (xs >= left) & (xs < left + self.cutout)
+            x = x * (~inside).unsqueeze(1).to(x.dtype)
+        return x
+
+
+def build_augment(cfg: DictConfig, device: torch.device) -> BatchAugment | None:
+    aug = cfg.task.get("augment")
+    if aug is None or not aug.enabled:
+        return None
+    # Offset by rank so data-parallel ranks draw different crops/flips/cutouts.
+    rank, _ = dist_rank_world()
+    return BatchAugment(aug.crop_padding, aug.flip, aug.cutout, seed=cfg.seed + rank, device=device)
+
+
 def load_cifar(cfg: DictConfig) -> tuple[nn.Module, DataLoader, DataLoader]:
+    if cfg.task.tensor_cache:
+        train_images, train_labels = build_cifar_cache("./data", train=True, dtype=cfg.task.cache_dtype)
+        val_images, val_labels = build_cifar_cache("./data", train=False, dtype=cfg.task.cache_dtype)
+        train_part = rank_slice(min(cfg.task.train_subset, len(train_labels)))
+        val_part = rank_slice(min(cfg.task.val_subset, len(val_labels)))
+        train_loader = CifarTensorLoader(train_images[train_part], train_labels[train_part], cfg.run.batch_size, shuffle=True)
+        val_loader = CifarTensorLoader(val_images[val_part], val_labels[val_part], cfg.run.batch_size, shuffle=False)
+        return SmallCnn(num_classes=cfg.task.num_classes), train_loader, val_loader
+
     transform = transforms.Compose(
         [
             transforms.ToTensor(),
-            transforms.Normalize((0.4914, 0.4822, 0.4465), (0.2470, 0.2435, 0.2616)),
+            transforms.Normalize(CIFAR_MEAN, CIFAR_STD),
         ]
     )
     train_ds = tv_datasets.CIFAR10(root="./data", train=True, download=True, transform=transform)
     test_ds = tv_datasets.CIFAR10(root="./data", train=False, download=True, transform=transform)
 
-    train_subset = Subset(train_ds, list(range(min(cfg.task.train_subset, len(train_ds)))))
-    val_subset = Subset(test_ds, list(range(min(cfg.task.val_subset, len(test_ds)))))
+    n_train = min(cfg.task.train_subset, len(train_ds))
+    n_val = min(cfg.task.val_subset, len(test_ds))
+    train_subset = Subset(train_ds, list(range(n_train))[rank_slice(n_train)])
+    val_subset = Subset(test_ds, list(range(n_val))[rank_slice(n_val)])
 
     train_loader = DataLoader(
         train_subset,
-        batch_size=cfg.run.batch_size,
-        shuffle=True,
+        batch_sampler=build_batch_sampler(train_subset, cfg.run.batch_size, shuffle=True),
         num_workers=cfg.run.num_workers,
         pin_memory=True,
     )
@@ -161,64 +1153,111 @@ def load_cifar(cfg: DictConfig) -> tuple[nn.Module, DataLoader, DataLoader]:
 
 def load_nanogpt_bin(cfg: DictConfig) -> tuple[nn.Module, DataLoader, DataLoader]:
     data_dir = os.path.expanduser(str(cfg.task.data_dir))
-    train_bin = os.path.join(data_dir, "train.bin")
-    val_bin = os.path.join(data_dir, "val.bin")
+    train_files = resolve_token_files(data_dir, str(cfg.task.train_files))
+    val_files = resolve_token_files(data_dir, str(cfg.task.val_files))
     meta_pkl = os.path.join(data_dir, "meta.pkl")
 
-    if not os.path.exists(train_bin) or not os.path.exists(val_bin):
+    if not train_files or not val_files:
         raise RuntimeError(
-            f"Expected train.bin and val.bin under {data_dir}. "
+            f"Expected {cfg.task.train_files} and {cfg.task.val_files} under {data_dir}. "
             "Create them with a NanoGPT-style prepare.py first."
         )
 
+    vocab_size = cfg.task.vocab_size
+    if str(vocab_size).lower() == "auto":
+        if os.path.exists(meta_pkl):
+            with open(meta_pkl, "rb") as f:
+                meta = pickle.load(f)
+            vocab_size = int(meta.get("vocab_size", 50257))
+        else:
+            vocab_size = 50257
+
+    token_dtype = str(cfg.task.token_dtype)
+    if token_dtype == "auto":
+        token_dtype = "uint32" if int(vocab_size) > 65536 else "uint16"
+
     block = int(cfg.task.block_size)
     train_ds = MemmapLmDataset(
-        data_path=train_bin,
+        data_path=train_files,
         block_size=block,
         num_examples=int(cfg.task.train_examples),
         seed=int(cfg.seed),
+        sampling=cfg.task.sampling,
+        dtype=np.dtype(token_dtype),
+        max_open_shards=cfg.task.max_open_shards,
     )
     val_ds = MemmapLmDataset(
-        data_path=val_bin,
+        data_path=val_files,
         block_size=block,
         num_examples=int(cfg.task.val_examples),
         seed=int(cfg.seed) + 1,
+        dtype=np.dtype(token_dtype),
+        max_open_shards=cfg.task.max_open_shards,
     )
 
-    train_loader = DataLoader(
-        train_ds,
-        batch_size=cfg.run.batch_size,
-        shuffle=True,
-        num_workers=cfg.run.num_workers,
-        pin_memory=True,
-    )
-    val_loader = DataLoader(
-        val_ds,
-        batch_size=cfg.run.batch_size,
-        shuffle=False,
-        num_workers=cfg.run.num_workers,
-        pin_memory=True,
-    )
+    # Data parallel: each rank trains and evaluates on its own contiguous share of windows.
+    train_ds.starts = train_ds.starts[rank_slice(len(train_ds.starts))]
+    val_ds.starts = val_ds.starts[rank_slice(len(val_ds.starts))]
+
+    train_sampler = None
+    if cfg.task.sampling == "sequential":
+        train_sampler = EpochBlockSampler(train_ds, seed=int(cfg.seed), io_block_tokens=int(cfg.task.io_block_tokens))
+
+    if cfg.task.prefetch_thread:
+        # In-process producer: run.num_workers does not apply.
+        train_loader = MemmapPrefetcher(
+            train_ds,
+            cfg.run.batch_size,
+            shuffle=True,
+            depth=cfg.task.prefetch_depth,
+            sampler=train_sampler,
+            hold=cfg.run.grad_accum_steps,
+        )
+        val_loader = MemmapPrefetcher(val_ds, cfg.run.batch_size, shuffle=False, depth=cfg.task.prefetch_depth)
+    elif cfg.task.batched_loader:
+        train_loader = DataLoader(
+            train_ds,
+            batch_size=None,
+            sampler=build_batch_sampler(train_ds, cfg.run.batch_size, shuffle=True, sampler=train_sampler),
+            num_workers=cfg.run.num_workers,
+            pin_memory=True,
+        )
+        val_loader = DataLoader(
+            val_ds,
+            batch_size=None,
+            sampler=build_batch_sampler(val_ds, cfg.run.batch_size, shuffle=False),
+            num_workers=cfg.run.num_workers,
+            pin_memory=True,
+        )
+    else:
+        train_loader = DataLoader(
+            train_ds,
+            batch_sampler=build_batch_sampler(train_ds, cfg.run.batch_size, shuffle=True, sampler=train_sampler),
+            num_workers=cfg.run.num_workers,
+            pin_memory=True,
+        )
+        val_loader = DataLoader(
+            val_ds,
+            batch_size=cfg.run.batch_size,
+            shuffle=False,
+            num_workers=cfg.run.num_workers,
+            pin_memory=True,
+        )
 
-    vocab_size = cfg.task.vocab_size
-    if str(vocab_size).lower() == "auto":
-        if os.path.exists(meta_pkl):
-            with open(meta_pkl, "rb") as f:
-                meta = pickle.load(f)
-            vocab_size = int(meta.get("vocab_size", 50257))
-        else:
-            vocab_size = 50257
+    return build_lm(cfg, vocab_size), train_loader, val_loader
 
-    model = TinyCausalLm(
-        vocab_size=int(vocab_size),
-        model_dim=cfg.task.model_dim,
-        num_layers=cfg.task.num_layers,
-        num_heads=cfg.task.num_heads,
-        ffn_dim=cfg.task.ffn_dim,
-        max_len=block,
-        dropout=cfg.task.dropout,
-    )
-    return model, train_loader, val_loader
+
+def split_muon_params(model: nn.Module) -> tuple[list[nn.Parameter], list[nn.Parameter]]:
+    """Split parameters into Muon matrices and AdamW leftovers (embeddings, biases, norms)."""
+    embedding_ids = {id(p) for m in model.modules() if isinstance(m, nn.Embedding) for p in m.parameters()}
+    muon_params = []
+    adamw_params = []
+    for p in model.parameters():
+        if p.ndim >= 2 and id(p) not in embedding_ids:
+            muon_params.append(p)
+        else:
+            adamw_params.append(p)
+    return muon_params, adamw_params
 
 
 def build_optimizer(cfg: DictConfig, model: nn.Module):
@@ -249,6 +1288,8 @@ def build_optimizer(cfg: DictConfig, model: nn.Module):
             betas=tuple(cfg.optimizer.betas),
             eps=cfg.optimizer.eps,
             weight_decay=cfg.optimizer.weight_decay,
+            foreach=cfg.optimizer.foreach,
+            flat_state=cfg.optimizer.flat_state,
         )
 
     if name == "adafactor":
@@ -269,7 +1310,21 @@ def build_optimizer(cfg: DictConfig, model: nn.Module):
             nesterov=cfg.optimizer.nesterov,
             weight_decay=cfg.optimizer.weight_decay,
         )
-        return SAM(model.parameters(), base_optimizer=base, rho=cfg.optimizer.rho)
+        perturb_params = None
+        if cfg.optimizer.variant == "partial":
+            prefixes = tuple(cfg.optimizer.partial_params)
+            perturb_params = [p for n, p in model.named_parameters() if n.startswith(prefixes)]
+            if not perturb_params:
+                raise ValueError(f"optimizer.partial_params={list(prefixes)} matched no parameters")
+        return SAM(
+            model.parameters(),
+            base_optimizer=base,
+            rho=cfg.optimizer.rho,
+            variant=cfg.optimizer.variant,
+            looksam_k=cfg.optimizer.looksam_k,
+            looksam_alpha=cfg.optimizer.looksam_alpha,
+            perturb_params=perturb_params,
+        )
 
     if name == "muon":
         return MuonLite(
@@ -278,146 +1333,802 @@ def build_optimizer(cfg: DictConfig, model: nn.Module):
             momentum=cfg.optimizer.momentum,
             weight_decay=cfg.optimizer.weight_decay,
             eps=cfg.optimizer.eps,
+            flat_state=cfg.optimizer.flat_state,
+        )
+
+    if name == "muon_ns":
+        muon_params, adamw_params = split_muon_params(model)
+        return Muon(
+            [
+                dict(params=muon_params, use_muon=True),
+                dict(params=adamw_params, use_muon=False),
+            ],
+            lr=cfg.optimizer.lr,
+            momentum=cfg.optimizer.momentum,
+            nesterov=cfg.optimizer.nesterov,
+            ns_steps=cfg.optimizer.ns_steps,
+            ns_dtype=getattr(torch, cfg.optimizer.ns_dtype),
+            weight_decay=cfg.optimizer.weight_decay,
+            adamw_lr=cfg.optimizer.adamw_lr,
+            adamw_betas=tuple(cfg.optimizer.adamw_betas),
+            adamw_eps=cfg.optimizer.adamw_eps,
+            adamw_weight_decay=cfg.optimizer.adamw_weight_decay,
         )
 
     raise ValueError(f"Unknown optimizer: {name}")
 
 
+def cache_eval_batches(loader: Any, device: torch.device) -> list[Any]:
+    """Materialize ``loader`` once as a fixed list of batches already on ``device``.
+
+    Periodic evals then skip data loading entirely (no workers, no
+    transforms, no memmap reads) and no longer draw from the torch RNG.
+    """
+    batches = []
+    for batch in loader:
+        if isinstance(batch, dict):
+            batches.append({k: v.to(device).clone() for k, v in batch.items()})
+        else:
+            batches.append(tuple(t.to(device).clone() for t in batch))
+    return batches
+
+
 @torch.no_grad()
-def eval_cifar(model: nn.Module, loader: DataLoader, device: torch.device) -> tuple[float, float]:
+def eval_cifar(model: nn.Module, loader: DataLoader, device: torch.device) -> tuple[float, float, float]:
+    """Mean loss, accuracy and images/sec; syncs with the device once, at the end."""
     model.eval()
-    total_loss = 0.0
+    start = time.perf_counter()
+    losses = []
+    correct = []
     total = 0
-    correct = 0
     for x, y in loader:
         x = x.to(device, non_blocking=True)
         y = y.to(device, non_blocking=True)
         logits = model(x)
-        loss = F.cross_entropy(logits, y)
-        total_loss += loss.item() * y.size(0)
-        pred = logits.argmax(dim=1)
-        correct += (pred == y).sum().item()
+        losses.append(F.cross_entropy(logits, y, reduction="sum"))
+        correct.append((logits.argmax(dim=1) == y).sum())
         total += y.size(0)
-    return total_loss / max(total, 1), correct / max(total, 1)
+    sums = [torch.stack(losses).sum(), torch.stack(correct).sum().float()] if losses else [torch.zeros((), device=device)] * 2
+    totals = torch.stack([*sums, torch.tensor(float(total), device=device)])
+    if dist_rank_world()[1] > 1:
+        dist.all_reduce(totals)  # sum over ranks' validation shards
+    total_loss, total_correct, total = totals.tolist()
+    if total == 0:
+        return 0.0, 0.0, 0.0
+    images_per_sec = total / (time.perf_counter() - start)
+    return total_loss / total, total_correct / total, images_per_sec
 
 
 @torch.no_grad()
-def eval_lm(model: nn.Module, loader: DataLoader, device: torch.device) -> tuple[float, float]:
+def eval_lm(model: nn.Module, loader: DataLoader, device: torch.device) -> tuple[float, float, float]:
+    """Mean NLL, perplexity and tokens/sec; syncs with the device once, at the end."""
     model.eval()
-    total_loss = 0.0
+    start = time.perf_counter()
+    losses = []
     total_tokens = 0
     for batch in loader:
         input_ids = batch["input_ids"].to(device, non_blocking=True)
         labels = batch["labels"].to(device, non_blocking=True)
-        logits = model(input_ids)
-        loss = F.cross_entropy(logits.view(-1, logits.size(-1)), labels.reshape(-1), reduction="sum")
-        total_loss += loss.item()
+        losses.append(model(input_ids, labels, reduction="sum"))
         total_tokens += labels.numel()
+    totals = torch.stack(
+        [torch.stack(losses).sum() if losses else torch.zeros((), device=device), torch.tensor(float(total_tokens), device=device)]
+    )
+    if dist_rank_world()[1] > 1:
+        dist.all_reduce(totals)  # sum over ranks' validation shards
+    total_loss, total_tokens = totals.tolist()
+    tokens_per_sec = total_tokens / (time.perf_counter() - start)
     nll = total_loss / max(total_tokens, 1)
     ppl = math.exp(min(20.0, nll))
-    return nll, ppl
+    return nll, ppl, tokens_per_sec
+
+
+class StepTimer:
+    """Split training step wall time into warmup and steady state.
+
+    With ``run.compile``/``run.compile_optimizer`` the first steps include
+    tracing, compilation and the recompile once gradients exist, so they are
+    reported as ``compile_sec`` and kept out of ``steady_step_ms``.
+    """
+
+    def __init__(self, cfg: DictConfig):
+        self.compiled = bool(cfg.run.compile or cfg.run.compile_optimizer)
+        self.warmup_steps = min(3 if self.compiled else 1, int(cfg.run.max_steps))
+        self.warmup_sec = 0.0
+        self.steady_sec = 0.0
+        self.steady_steps = 0
+
+    def record(self, step: int, elapsed: float) -> None:
+        if step > self.warmup_steps:
+            self.steady_sec += elapsed
+            self.steady_steps += 1
+            return
+        self.warmup_sec += elapsed
+        if step == self.warmup_steps:
+            label = "compile_sec" if self.compiled else "first_step_sec"
+            print(f"step={step} {label}={self.warmup_sec:.2f}")
+
+    def summary(self) -> None:
+        if self.steady_steps:
+            print(f"steady_step_ms={self.steady_sec / self.steady_steps * 1e3:.2f}")
+
+
+def unwrap_model(model: nn.Module) -> nn.Module:
+    """The plain module behind ``torch.compile`` and ``DistributedDataParallel`` wrappers."""
+    model = getattr(model, "_orig_mod", model)
+    return model.module if isinstance(model, DistributedDataParallel) else model
+
+
+def _cpu_copy(obj: Any) -> Any:
+    if torch.is_tensor(obj):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {k: _cpu_copy(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_cpu_copy(v) for v in obj)
+    return obj
+
+
+class CheckpointManager:
+    """Periodic, resumable training checkpoints in ``run.checkpoint_dir``.
+
+    Every ``run.checkpoint_every`` steps the training thread copies the model,
+    optimizer, grad scaler, RNG, augmentation and data-position state to CPU.
+    A background thread then writes it with ``torch.save`` while training
+    continues; at most one write is in flight. Each rank writes
+    ``step_<N>/rank<r>-of-<world>.pt`` atomically, and a step is complete
+    once every rank's file exists. Rank 0's file also holds the model, and
+    the optimizer unless it is ZeRO-sharded, in which case each rank saves
+    its own shard. Rank 0 keeps the newest ``run.checkpoint_keep`` steps.
+
+    With ``run.resume``, ``restore`` loads the newest complete step with
+    ``torch.load(mmap=True)``, so tensors are paged in from the file as they
+    are copied into place. It returns the step to continue after; the
+    resumed run then follows the uninterrupted trajectory exactly.
+    """
+
+    def __init__(self, cfg: DictConfig, model: nn.Module, optimizer, scaler, batches: ResumableBatches, augment=None):
+        self.every = int(cfg.run.checkpoint_every)
+        self.root = str(cfg.run.checkpoint_dir)
+        self.keep = max(1, int(cfg.run.checkpoint_keep))
+        self.resume = bool(cfg.run.resume)
+        self.model = unwrap_model(model)
+        self.optimizer = optimizer
+        self.scaler = scaler
+        self.batches = batches
+        self.augment = augment
+        self.rank, self.world = dist_rank_world()
+        base = optimizer.base_optimizer if isinstance(optimizer, SAM) else optimizer
+        self.sharded = isinstance(base, ZeroShardedOptimizer)
+        self._thread: threading.Thread | None = None
+        self._result: Any = None
+
+    def _file(self, step_dir: str, rank: int) -> str:
+        return os.path.join(step_dir, f"rank{rank}-of-{self.world}.pt")
+
+    def complete_steps(self) -> list[str]:
+        """Step directories that every rank finished writing, oldest first."""
+        dirs = sorted(glob.glob(os.path.join(self.root, "step_*")))
+        return [d for d in dirs if all(os.path.exists(self._file(d, r)) for r in range(self.world))]
+
+    def _capture(self, step: int) -> dict[str, Any]:
+        rng = capture_rng_state()
+        name, keys, *rest = rng["numpy"]
+        rng["numpy"] = (name, torch.from_numpy(keys.astype(np.int64)), *rest)
+        state: dict[str, Any] = {
+            "step": step,
+            "rng": rng,
+            "data": self.batches.state_dict(),
+            "scaler": self.scaler.state_dict(),
+            "augment": None if self.augment is None else self.augment.generator.get_state(),
+        }
+        if self.rank == 0:
+            state["model"] = self.model.state_dict()
+        if self.rank == 0 or self.sharded:
+            state["optimizer"] = self.optimizer.state_dict()
+        return _cpu_copy(state)
+
+    def maybe_save(self, step: int) -> None:
+        if self.every <= 0 or step % self.every:
+            return
+        self._wait()
+        start = time.perf_counter()
+        state = self._capture(step)
+        snapshot_ms = (time.perf_counter() - start) * 1e3
+        self._thread = threading.Thread(target=self._write, args=(step, state, snapshot_ms), daemon=True)
+        self._thread.start()
+
+    def _write(self, step: int, state: dict[str, Any], snapshot_ms: float) -> None:
+        try:
+            start = time.perf_counter()
+            step_dir = os.path.join(self.root, f"step_{step:08d}")
+            os.makedirs(step_dir, exist_ok=True)
+            path = self._file(step_dir, self.rank)
+            tmp = f"{path}.tmp"
+            torch.save(state, tmp)
+            os.replace(tmp, path)
+            if self.rank == 0:
+                for old in self.complete_steps()[: -self.keep]:
+                    shutil.rmtree(old, ignore_errors=True)
+            self._result = (step, step_dir, snapshot_ms, time.perf_counter() - start)
+        except BaseException as exc:  # re-raised on the training thread
+            self._result = exc
+
+    def _wait(self) -> None:
+        if self._thread is None:
+            return
+        self._thread.join()
+        self._thread = None
+        result, self._result = self._result, None
+        if isinstance(result, BaseException):
+            raise result
+        step, step_dir, snapshot_ms, write_sec = result
+        print(f"checkpoint step={step} dir={step_dir} snapshot_ms={snapshot_ms:.1f} write_sec={write_sec:.2f}")
+
+    def close(self) -> None:
+        self._wait()
+
+    def restore(self) -> int:
+        if not self.resume:
+            return 0
+        steps = self.complete_steps()
+        if not steps:
+            print(f"resume: no complete checkpoint for {self.world} rank(s) in {self.root}")
+            return 0
+        start = time.perf_counter()
+
+        def load(rank: int) -> dict[str, Any]:
+            return torch.load(self._file(steps[-1], rank), map_location="cpu", mmap=True, weights_only=True)
+
+        own = load(self.rank)
+        main = own if self.rank == 0 else load(0)
+        self.model.load_state_dict(main["model"])
+        self.optimizer.load_state_dict((own if self.sharded else main)["optimizer"])
+        self.scaler.load_state_dict(own["scaler"])
+        if self.augment is not None:
+            self.augment.generator.set_state(own["augment"])
+        # Replaying the data position draws from the RNG, so restore the RNG last.
+        self.batches.load_state_dict(own["data"])
+        rng = dict(own["rng"])
+        name, keys, *rest = rng["numpy"]
+        rng["numpy"] = (name, keys.numpy().astype(np.uint32), *rest)
+        restore_rng_state(rng)
+        print(f"resumed step={own['step']} dir={steps[-1]} load_sec={time.perf_counter() - start:.2f}")
+        return int(own["step"])
+
+
+def _async_eval_worker(conn, shadow: nn.Module, eval_fn, batches: list[Any], device: torch.device, threads: int) -> None:
+    if threads > 0:
+        torch.set_num_threads(threads)
+    while True:
+        step = conn.recv()
+        if step is None:
+            return
+        try:
+            conn.send((step, eval_fn(shadow, batches, device)))
+        except Exception as exc:  # re-raised on the training side
+            conn.send(exc)
+
+
+class AsyncEvaluator:
+    """Evaluate a snapshot of the model in the background while training continues.
+
+    ``submit`` copies the current weights into a shadow model and returns; at
+    most one eval is in flight, so a new ``submit`` first waits for the
+    previous one. On CPU the shadow lives in shared memory and is evaluated
+    by a forked worker process limited to ``threads`` intra-op threads (torch
+    thread counts are per process). On CUDA a thread evaluates it on its own
+    stream. Results are printed from the training loop by ``poll``/``close``,
+    tagged with the step the snapshot was taken at.
+
+    ``batches`` must be pre-materialized (``cache_eval_batches``): the eval
+    then never touches the torch RNG or the training data pipeline, so the
+    training trajectory is identical to a run with synchronous
+    ``run.eval_cache=true``.
+    """
+
+    def __init__(self, model: nn.Module, eval_fn, batches: list[Any], device: torch.device, threads: int, log):
+        self.shadow = copy.deepcopy(getattr(model, "_orig_mod", model))
+        self.shadow.requires_grad_(False)
+        self.eval_fn = eval_fn
+        self.batches = batches
+        self.device = device
+        self.log = log
+        self._pending = False
+        self._proc = None
+        self._thread: threading.Thread | None = None
+        self._result: Any = None
+        self.stream = torch.cuda.Stream(device) if device.type == "cuda" else None
+        # Pool workers (sweep.workers > 1) are daemonic and cannot fork; use a thread there.
+        # Likewise once helper threads run (prefetcher, checkpoint writer): a fork taken
+        # while one of them holds a lock can deadlock the child.
+        if device.type == "cpu" and not mp.current_process().daemon and threading.active_count() == 1:
+            self.shadow.share_memory()
+            ctx = mp.get_context("fork")
+            self._conn, child = ctx.Pipe()
+            self._proc = ctx.Process(
+                target=_async_eval_worker, args=(child, self.shadow, eval_fn, batches, device, int(threads)), daemon=True
+            )
+            self._proc.start()
+        self._shadow_tensors = list(self.shadow.state_dict().values())
+
+    def submit(self, step: int, model: nn.Module) -> None:
+        self._wait()
+        source = list(getattr(model, "_orig_mod", model).state_dict().values())
+        with torch.no_grad():
+            torch._foreach_copy_(self._shadow_tensors, source)
+        self._pending = True
+        if self._proc is not None:
+            self._conn.send(step)
+            return
+        ready = None
+        if self.stream is not None:
+            ready = torch.cuda.Event()
+            ready.record()
+        self._thread = threading.Thread(target=self._run, args=(step, ready), daemon=True)
+        self._thread.start()
+
+    def _run(self, step: int, ready) -> None:
+        try:
+            ctx = torch.cuda.stream(self.stream) if self.stream is not None else contextlib.nullcontext()
+            with ctx:
+                if ready is not None:
+                    self.stream.wait_event(ready)
+                self._result = (step, self.eval_fn(self.shadow, self.batches, self.device))
+        except BaseException as exc:  # re-raised on the training thread
+            self._result = exc
+
+    def _wait(self) -> None:
+        if not self._pending:
+            return
+        if self._proc is not None:
+            result = self._conn.recv()
+        else:
+            self._thread.join()
+            result, self._result = self._result, None
+        self._pending = False
+        if isinstance(result, BaseException):
+            raise result
+        self.log(*result)
+
+    def poll(self) -> None:
+        """Print the in-flight result if it has finished; never blocks."""
+        if not self._pending:
+            return
+        done = self._conn.poll() if self._proc is not None else not self._thread.is_alive()
+        if done:
+            self._wait()
+
+    def close(self) -> None:
+        self._wait()
+        if self._proc is not None:
+            self._conn.send(None)
+            self._proc.join()
+            self._proc = None
+
+
+def backward_micro_batches(model: nn.Module, loss_fn, batches: list, scaler, precision: str, device: torch.device) -> torch.Tensor:
+    """Accumulate gradients of the mean loss over ``batches`` and return that mean loss.
+
+    Each micro-batch loss is scaled by ``1 / len(batches)``, so the summed
+    gradient matches one batch of all the samples. Under DDP the gradient
+    all-reduce runs only in the last backward.
+    """
+    total = None
+    for i, batch in enumerate(batches):
+        last = i == len(batches) - 1
+        with contextlib.nullcontext() if last or not hasattr(model, "no_sync") else model.no_sync():
+            with autocast_context(precision, device):
+                loss = loss_fn(model, batch)
+            scaler.scale(loss / len(batches) if len(batches) > 1 else loss).backward()
+        total = loss.detach() if total is None else total + loss.detach()
+    return total / len(batches) if len(batches) > 1 else total
+
+
+def train_step(cfg: DictConfig, model: nn.Module, loss_fn, batches: list, optimizer, scaler, device: torch.device) -> float:
+    """One optimizer step over ``batches`` (``run.grad_accum_steps`` micro-batches); returns the loss.
+
+    SAM needs the ascent direction of the whole batch, so both of its passes
+    accumulate over the same micro-batches before ``first_step`` and
+    ``second_step``.
+    """
+    precision = cfg.run.precision
+    # Partial SAM's second pass skips the frozen layers' weight gradients and
+    # the input gradients below them; count both passes' FLOPs once to price it.
+    count = cfg.optimizer.name == "sam" and optimizer.second_pass_cost is None
+    flops = [FlopCounterMode(display=False) if count else contextlib.nullcontext() for _ in range(2)]
+    optimizer.zero_grad()
+    with flops[0]:
+        loss = backward_micro_batches(model, loss_fn, batches, scaler, precision, device)
+    if cfg.optimizer.name == "sam":
+        if optimizer.first_step():
+            optimizer.zero_grad()
+            with flops[1]:
+                loss = backward_micro_batches(model, loss_fn, batches, scaler, precision, device)
+            if count:
+                first = flops[0].get_total_flops()
+                # Compiled graphs hide their ops from the counter; fall back to a full pass.
+                optimizer.second_pass_cost = flops[1].get_total_flops() / first if first else 1.0
+        optimizer.second_step(base_step=lambda: scaler.step(optimizer.base_optimizer))
+    else:
+        scaler.step(optimizer)
+    scaler.update()
+    return loss.item()
 
 
 def train_cifar(cfg: DictConfig, model: nn.Module, train_loader: DataLoader, val_loader: DataLoader, optimizer, device: torch.device):
     model.train()
-    step_iter = _batch_iter(train_loader)
-
-    for step in range(1, cfg.run.max_steps + 1):
-        x, y = next(step_iter)
-        x = x.to(device, non_blocking=True)
-        y = y.to(device, non_blocking=True)
-
-        if cfg.optimizer.name == "sam":
-            optimizer.zero_grad()
-            loss = F.cross_entropy(model(x), y)
-            loss.backward()
-            optimizer.first_step()
-
-            optimizer.zero_grad()
-            loss2 = F.cross_entropy(model(x), y)
-            loss2.backward()
-            optimizer.second_step()
-            loss_value = loss2.item()
-        else:
-            optimizer.zero_grad()
-            logits = model(x)
-            loss = F.cross_entropy(logits, y)
-            loss.backward()
-            optimizer.step()
-            loss_value = loss.item()
+    step_iter = ResumableBatches(train_loader)
+    scaler = build_grad_scaler(cfg.run.precision, device)
+    log_start = time.perf_counter()
+    images = 0
+    world = dist_rank_world()[1]
+    timer = StepTimer(cfg)
+    augment = build_augment(cfg, device)
+    # Before restore() starts any loader thread, so the CPU evaluator can still fork.
+    evaluator = None
+    if cfg.run.async_eval:
+        evaluator = AsyncEvaluator(
+            model,
+            eval_cifar,
+            val_loader,
+            device,
+            cfg.run.eval_threads,
+            log=lambda step, r: print(f"step={step} val_loss={r[0]:.4f} val_acc={r[1]:.4f} eval_images_per_sec={r[2]:.1f}"),
+        )
+    checkpoints = CheckpointManager(cfg, model, optimizer, scaler, step_iter, augment)
+    start_step = checkpoints.restore()
+
+    for step in range(start_step + 1, cfg.run.max_steps + 1):
+        step_start = time.perf_counter()
+        batches = []
+        for _ in range(cfg.run.grad_accum_steps):
+            x, y = next(step_iter)
+            x = x.to(device, non_blocking=True)
+            y = y.to(device, non_blocking=True)
+            if augment is not None:
+                x = augment(x)
+            batches.append((x, y))
+            images += y.size(0) * world
+
+        loss_value = train_step(cfg, model, lambda m, b: F.cross_entropy(m(b[0]), b[1]), batches, optimizer, scaler, device)
+        timer.record(step - start_step, time.perf_counter() - step_start)
 
         if step % cfg.run.log_every == 0:
-            print(f"step={step} train_loss={loss_value:.4f}")
-
-        if step % cfg.run.eval_every == 0:
-            val_loss, val_acc = eval_cifar(model, val_loader, device)
-            print(f"step={step} val_loss={val_loss:.4f} val_acc={val_acc:.4f}")
+            images_per_sec = images / (time.perf_counter() - log_start)
+            print(f"step={step} train_loss={loss_value:.4f} images_per_sec={images_per_sec:.1f}")
+            log_start = time.perf_counter()
+            images = 0
+
+        if evaluator is not None:
+            evaluator.poll()
+            if step % cfg.run.eval_every == 0:
+                evaluator.submit(step, model)
+        elif step % cfg.run.eval_every == 0:
+            val_loss, val_acc, eval_rate = eval_cifar(model, val_loader, device)
+            print(f"step={step} val_loss={val_loss:.4f} val_acc={val_acc:.4f} eval_images_per_sec={eval_rate:.1f}")
             model.train()
+            log_start = time.perf_counter()
+            images = 0
+        checkpoints.maybe_save(step)
+
+    if evaluator is not None:
+        evaluator.close()
+    checkpoints.close()
+    timer.summary()
 
 
 def train_lm(cfg: DictConfig, model: nn.Module, train_loader: DataLoader, val_loader: DataLoader, optimizer, device: torch.device):
     model.train()
-    step_iter = _batch_iter(train_loader)
-
-    for step in range(1, cfg.run.max_steps + 1):
-        batch = next(step_iter)
-        input_ids = batch["input_ids"].to(device, non_blocking=True)
-        labels = batch["labels"].to(device, non_blocking=True)
-
-        if cfg.optimizer.name == "sam":
-            optimizer.zero_grad()
-            logits = model(input_ids)
-            loss = F.cross_entropy(logits.view(-1, logits.size(-1)), labels.reshape(-1))
-            loss.backward()
-            optimizer.first_step()
-
-            optimizer.zero_grad()
-            logits2 = model(input_ids)
-            loss2 = F.cross_entropy(logits2.view(-1, logits2.size(-1)), labels.reshape(-1))
-            loss2.backward()
-            optimizer.second_step()
-            loss_value = loss2.item()
-        else:
-            optimizer.zero_grad()
-            logits = model(input_ids)
-            loss = F.cross_entropy(logits.view(-1, logits.size(-1)), labels.reshape(-1))
-            loss.backward()
-            optimizer.step()
-            loss_value = loss.item()
+    step_iter = ResumableBatches(train_loader)
+    scaler = build_grad_scaler(cfg.run.precision, device)
+    log_start = time.perf_counter()
+    tokens = 0
+    world = dist_rank_world()[1]
+    timer = StepTimer(cfg)
+    # Before restore() starts any loader thread, so the CPU evaluator can still fork.
+    evaluator = None
+    if cfg.run.async_eval:
+        evaluator = AsyncEvaluator(
+            model,
+            eval_lm,
+            val_loader,
+            device,
+            cfg.run.eval_threads,
+            log=lambda step, r: print(f"step={step} val_nll={r[0]:.4f} val_ppl={r[1]:.2f} eval_tokens_per_sec={r[2]:.1f}"),
+        )
+    checkpoints = CheckpointManager(cfg, model, optimizer, scaler, step_iter)
+    start_step = checkpoints.restore()
+
+    for step in range(start_step + 1, cfg.run.max_steps + 1):
+        step_start = time.perf_counter()
+        batches = []
+        for _ in range(cfg.run.grad_accum_steps):
+            batch = next(step_iter)
+            input_ids = batch["input_ids"].to(device, non_blocking=True)
+            labels = batch["labels"].to(device, non_blocking=True)
+            batches.append((input_ids, labels))
+            tokens += labels.numel() * world
+
+        loss_value = train_step(cfg, model, lambda m, b: m(*b), batches, optimizer, scaler, device)
+        timer.record(step - start_step, time.perf_counter() - step_start)
 
         if step % cfg.run.log_every == 0:
-            print(f"step={step} train_nll={loss_value:.4f} train_ppl={math.exp(min(20.0, loss_value)):.2f}")
-
-        if step % cfg.run.eval_every == 0:
-            val_nll, val_ppl = eval_lm(model, val_loader, device)
-            print(f"step={step} val_nll={val_nll:.4f} val_ppl={val_ppl:.2f}")
+            tokens_per_sec = tokens / (time.perf_counter() - log_start)
+            print(
+                f"step={step} train_nll={loss_value:.4f} train_ppl={math.exp(min(20.0, loss_value)):.2f} "
+                f"tokens_per_sec={tokens_per_sec:.1f}"
+            )
+            log_start = time.perf_counter()
+            tokens = 0
+
+        if evaluator is not None:
+            evaluator.poll()
+            if step % cfg.run.eval_every == 0:
+                evaluator.submit(step, model)
+        elif step % cfg.run.eval_every == 0:
+            val_nll, val_ppl, eval_rate = eval_lm(model, val_loader, device)
+            print(f"step={step} val_nll={val_nll:.4f} val_ppl={val_ppl:.2f} eval_tokens_per_sec={eval_rate:.1f}")
             model.train()
+            log_start = time.perf_counter()
+            tokens = 0
+        checkpoints.maybe_save(step)
 
+    if evaluator is not None:
+        evaluator.close()
+    checkpoints.close()
+    timer.summary()
 
-@hydra.main(config_path="configs", config_name="config", version_base="1.3")
-def main(cfg: DictConfig) -> None:
-    set_seed(cfg.seed)
-    device = resolve_device(cfg.device)
-    print(f"task={cfg.task.name} optimizer={cfg.optimizer.name} device={device}")
 
+def load_task(cfg: DictConfig) -> tuple[nn.Module, DataLoader, DataLoader]:
     if cfg.task.name == "cifar10":
-        model, train_loader, val_loader = load_cifar(cfg)
-    elif cfg.task.name == "nanogpt_bin":
-        model, train_loader, val_loader = load_nanogpt_bin(cfg)
-    else:
-        raise ValueError(f"Unknown task: {cfg.task.name}")
+        return load_cifar(cfg)
+    if cfg.task.name == "nanogpt_bin":
+        return load_nanogpt_bin(cfg)
+    raise ValueError(f"Unknown task: {cfg.task.name}")
 
-    model.to(device)
+
+def run_experiment(cfg: DictConfig, model: nn.Module, train_loader: DataLoader, val_loader: DataLoader, device: torch.device) -> None:
+    """Build the optimizer for ``cfg``, train ``model`` in place and print the final metrics."""
     optimizer = build_optimizer(cfg, model)
 
+    if dist_rank_world()[1] > 1:
+        if cfg.run.async_eval:
+            raise ValueError("run.async_eval is not supported with data-parallel ranks")
+        # Partial SAM freezes parameters for its second pass, so they get no gradient there.
+        partial_sam = cfg.optimizer.name == "sam" and cfg.optimizer.variant == "partial"
+        model = DistributedDataParallel(model, broadcast_buffers=False, find_unused_parameters=partial_sam)
+        if cfg.run.zero:
+            if isinstance(optimizer, SAM):
+                optimizer.base_optimizer = ZeroShardedOptimizer(optimizer.base_optimizer)
+            else:
+                optimizer = ZeroShardedOptimizer(optimizer)
+
+    if cfg.run.compile or cfg.run.compile_optimizer:
+        enable_compile_cache(cfg.run.compile_cache_dir)
+    # Compile after build_optimizer so parameter names keep their original prefixes.
+    if cfg.run.compile:
+        model = torch.compile(model)
+    if cfg.run.compile_optimizer:
+        compile_optimizer_step(optimizer)
+    if cfg.run.eval_cache or cfg.run.async_eval:
+        val_loader = cache_eval_batches(val_loader, device)
+
     if cfg.task.name == "cifar10":
         train_cifar(cfg, model, train_loader, val_loader, optimizer, device)
-        val_loss, val_acc = eval_cifar(model, val_loader, device)
-        print(f"final val_loss={val_loss:.4f} val_acc={val_acc:.4f}")
+        val_loss, val_acc, eval_rate = eval_cifar(model, val_loader, device)
+        print(f"final val_loss={val_loss:.4f} val_acc={val_acc:.4f} eval_images_per_sec={eval_rate:.1f}")
     else:
         train_lm(cfg, model, train_loader, val_loader, optimizer, device)
-        val_nll, val_ppl = eval_lm(model, val_loader, device)
-        print(f"final val_nll={val_nll:.4f} val_ppl={val_ppl:.2f}")
+        val_nll, val_ppl, eval_rate = eval_lm(model, val_loader, device)
+        print(f"final val_nll={val_nll:.4f} val_ppl={val_ppl:.2f} eval_tokens_per_sec={eval_rate:.1f}")
+
+    if cfg.run.zero and dist_rank_world()[1] > 1:
+        print_zero_memory(optimizer.base_optimizer if isinstance(optimizer, SAM) else optimizer)
+    if cfg.optimizer.name == "sam":
+        print(f"sam variant={optimizer.variant} compute_multiplier={optimizer.compute_multiplier:.2f}")
+
+
+def print_zero_memory(optimizer: ZeroShardedOptimizer) -> None:
+    """Print each rank's optimizer-state size next to the replicated (unsharded) size."""
+    per_rank = [0] * optimizer.world
+    dist.all_gather_object(per_rank, optimizer.state_bytes())
+    replicated = sum(per_rank)
+    print(
+        f"zero optimizer_state_mb per_rank=[{', '.join(f'{b / 2**20:.2f}' for b in per_rank)}] "
+        f"replicated={replicated / 2**20:.2f} saved={1 - max(per_rank) / max(replicated, 1):.2%}"
+    )
+
+
+def print_run_header(cfg: DictConfig, device: torch.device) -> None:
+    print(f"task={cfg.task.name} optimizer={cfg.optimizer.name} device={device} precision={cfg.run.precision}")
+
+
+def rss_mb(field: str) -> float:
+    """A ``/proc/self/status`` memory field (``VmRSS``, ``VmHWM``, ...) in MB."""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    raise RuntimeError(f"{field} missing from /proc/self/status")
+
+
+def micro_step_peak_mb(cfg: DictConfig, device: torch.device) -> float:
+    """Memory one forward/backward at ``run.batch_size`` adds on top of the loaded model and batch.
+
+    On CUDA this is the allocator peak. On CPU it is the process high-water
+    RSS after resetting it via ``/proc/self/clear_refs``, so call it in a
+    fresh (forked) process.
+    """
+    model, train_loader, _ = load_task(cfg)
+    model.to(device).train()
+    batch = next(iter(train_loader))
+    if cfg.task.name == "cifar10":
+        batch = (batch[0].to(device), batch[1].to(device))
+
+        def loss_fn(m, b):
+            return F.cross_entropy(m(b[0]), b[1])
+
+    else:
+        batch = (batch["input_ids"].to(device), batch["labels"].to(device))
+
+        def loss_fn(m, b):
+            return m(*b)
+
+    scaler = build_grad_scaler(cfg.run.precision, device)
+    # Warm up on one sample so one-time allocations (thread pools, workspaces) are not billed to the batch.
+    backward_micro_batches(model, loss_fn, [tuple(t[:1] for t in batch)], scaler, cfg.run.precision, device)
+    model.zero_grad(set_to_none=True)
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+        base = torch.cuda.memory_allocated(device)
+        torch.cuda.reset_peak_memory_stats(device)
+        backward_micro_batches(model, loss_fn, [batch], scaler, cfg.run.precision, device)
+        torch.cuda.synchronize(device)
+        return (torch.cuda.max_memory_allocated(device) - base) / 2**20
+    base = rss_mb("VmRSS")
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")  # reset VmHWM to the current RSS
+    backward_micro_batches(model, loss_fn, [batch], scaler, cfg.run.precision, device)
+    return rss_mb("VmHWM") - base
+
+
+def _micro_step_worker(cfg: DictConfig, device: torch.device, conn) -> None:
+    try:
+        conn.send(micro_step_peak_mb(cfg, device))
+    except Exception as exc:  # re-raised in the parent
+        conn.send(exc)
+
+
+def probe_micro_step_mb(cfg: DictConfig, device: torch.device) -> float:
+    """``micro_step_peak_mb`` measured without touching this process; ``inf`` if it runs out of memory."""
+    if device.type == "cuda":
+        try:
+            return micro_step_peak_mb(cfg, device)
+        except torch.cuda.OutOfMemoryError:
+            return math.inf
+        finally:
+            torch.cuda.empty_cache()
+    ctx = mp.get_context("fork")
+    recv, send = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_micro_step_worker, args=(cfg, device, send))
+    proc.start()
+    send.close()
+    try:
+        result = recv.recv()
+    except EOFError:
+        result = math.inf  # killed, e.g. by the OOM killer
+    proc.join()
+    if isinstance(result, BaseException):
+        raise result
+    return result
+
+
+def resolve_grad_accum(cfg: DictConfig, device: torch.device) -> None:
+    """Turn ``run.grad_accum_steps=auto`` into a micro ``run.batch_size`` and an accumulation count.
+
+    The per-rank share of ``run.global_batch_size`` is split into the largest
+    micro-batch (a divisor of it, found by binary search) whose forward/backward
+    fits ``run.micro_batch_budget_mb``. Rank 0 probes and broadcasts the result.
+    """
+    rank, world = dist_rank_world()
+    global_batch = int(cfg.run.global_batch_size)
+    if global_batch <= 0 or global_batch % world:
+        raise ValueError(f"run.global_batch_size={global_batch} must be a positive multiple of the {world} ranks")
+    per_rank = global_batch // world
+    budget = float(cfg.run.micro_batch_budget_mb)
+
+    choice: list[Any] = [None, None]
+    if rank == 0:
+        sizes = [b for b in range(1, per_rank + 1) if per_rank % b == 0]
+        peaks: dict[int, float] = {}
+        lo, hi = 0, len(sizes) - 1
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            probe_cfg = copy.deepcopy(cfg)
+            probe_cfg.run.batch_size = sizes[mid]
+            peaks[sizes[mid]] = probe_micro_step_mb(probe_cfg, device)
+            if peaks[sizes[mid]] <= budget:
+                choice = [sizes[mid], peaks[sizes[mid]]]
+                lo = mid + 1
+            else:
+                hi = mid - 1
+        if choice[0] is None:
+            choice = [None, f"a micro-batch of 1 needs {peaks[1]:.1f} MB, over run.micro_batch_budget_mb={budget:g}"]
+    if world > 1:
+        dist.broadcast_object_list(choice, src=0)
+    micro, peak = choice
+    if micro is None:
+        raise ValueError(peak)
+    cfg.run.batch_size = micro
+    cfg.run.grad_accum_steps = per_rank // micro
+    print(
+        f"grad_accum micro_batch_size={micro} grad_accum_steps={per_rank // micro} "
+        f"global_batch_size={global_batch} micro_step_peak_mb={peak:.1f}"
+    )
+
+
+def train_process(cfg: DictConfig) -> None:
+    set_seed(cfg.seed)
+    device = resolve_device(cfg.device)
+    print_run_header(cfg, device)
+    if str(cfg.run.grad_accum_steps) == "auto":
+        resolve_grad_accum(cfg, device)
+        set_seed(cfg.seed)  # the in-process CUDA probe draws from the RNG
+
+    model, train_loader, val_loader = load_task(cfg)
+    model.to(device)
+    run_experiment(cfg, model, train_loader, val_loader, device)
+
+
+def _ddp_worker(rank: int, world: int, port: int, threads: int, cfg: DictConfig) -> None:
+    pin_cpu_slot(rank, threads)
+    os.environ["MASTER_ADDR"] = "127.0.0.1"
+    os.environ["MASTER_PORT"] = str(port)
+    dist.init_process_group("gloo", rank=rank, world_size=world)
+    if rank != 0:
+        sys.stdout = open(os.devnull, "w")
+    try:
+        train_process(cfg)
+    finally:
+        dist.destroy_process_group()
+
+
+def launch_ddp(cfg: DictConfig, ranks: int) -> None:
+    """Run ``train_process`` in ``ranks`` forked CPU processes under DDP (gloo); rank 0 prints."""
+    if resolve_device(cfg.device).type != "cpu":
+        raise ValueError("run.ddp_ranks > 1 uses the gloo backend and is CPU-only.")
+    threads = int(cfg.run.ddp_threads_per_rank) or max(1, (os.cpu_count() or 1) // ranks)
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    ctx = mp.get_context("fork")
+    procs = [ctx.Process(target=_ddp_worker, args=(rank, ranks, port, threads, cfg)) for rank in range(ranks)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    failed = [rank for rank, p in enumerate(procs) if p.exitcode != 0]
+    if failed:
+        raise RuntimeError(f"data-parallel ranks {failed} failed")
+
+
+@hydra.main(config_path="configs", config_name="config", version_base="1.3")
+def main(cfg: DictConfig) -> None:
+    if int(os.environ.get("WORLD_SIZE", "1")) > 1 and not dist.is_initialized():
+        # Launched by torchrun: one process per rank, rendezvous from the environment.
+        dist.init_process_group("gloo")
+        if dist.get_rank() != 0:
+            sys.stdout = open(os.devnull, "w")
+        try:
+            train_process(cfg)
+        finally:
+            dist.destroy_process_group()
+        return
+    if int(cfg.run.ddp_ranks) > 1:
+        launch_ddp(cfg, int(cfg.run.ddp_ranks))
+        return
+    train_process(cfg)
 
 
 if __name__ == "__main__":